@@ -1,11 +1,21 @@
+import sys
 import streamlit as st
 from pathlib import Path
-import tempfile
 from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
 
-from utils.document_loader import load_single_pdf
-from utils.qa_chain import create_qa_chain, create_topic_qa_chain
+from utils.answer_cache import create_answer_cache
+from utils.document_loader import EMBEDDING_KEY, count_pdf_pages, create_embeddings
+from utils.index_registry import IndexRegistry
+from utils.index_versions import POINTER_NAME, current_version, current_version_path
+from utils.mapped_index import INFO_NAME, MAPPED_DIR_NAME, MappedVectorStore
+from utils.parent_child import CHILD_DIR_NAME, ParentChildRetriever
+from utils.progressive_ingest import PROGRESSIVE_MIN_PAGES, ProgressiveIngestion
+from utils.upload_cache import content_key, create_upload_cache
+from utils.qa_chain import AnswerStreamHandler, create_qa_chain, create_topic_qa_chain, is_self_contained
+
+# shared helpers live in common/ at the project root
+sys.path.append(str(Path(__file__).parent.parent))
+from common.document_catalog import get_document_catalog
 
 # Initialize session state
 if "messages" not in st.session_state:
@@ -23,9 +33,26 @@ if "db" not in st.session_state:
 if "current_pdf_name" not in st.session_state:
     st.session_state.current_pdf_name = None
 
+# background indexing of a big upload, and which pages of it
+if "ingestion" not in st.session_state:
+    st.session_state.ingestion = None
+
+if "ingestion_status" not in st.session_state:
+    st.session_state.ingestion_status = None
+
+if "upload_pages" not in st.session_state:
+    st.session_state.upload_pages = None
+
+if "upload_range" not in st.session_state:
+    st.session_state.upload_range = None
+
 if "current_topic" not in st.session_state:
     st.session_state.current_topic = None
 
+# which subject / lecture answers may be shared across sessions for, None if they can't be
+if "answer_scope" not in st.session_state:
+    st.session_state.answer_scope = None
+
 # Add CSS to fix white line and ensure proper spacing
 st.markdown("""
 <style>
@@ -45,37 +72,85 @@ doc_option = st.sidebar.radio(
 )
 
 def load_faiss_index():
-    if (Path(__file__).parent.parent / "faiss_index").exists():
-        embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
-        return FAISS.load_local(str(Path(__file__).parent.parent / "faiss_index"), embeddings, allow_dangerous_deserialization=True)
+    faiss_path = Path(__file__).parent.parent / "faiss_index"
+    # published builds live in versions/, older setups have the index right in faiss_index/
+    index_path = current_version_path(faiss_path) or faiss_path
+    # prefer the memory-mapped copy, it opens instantly and doesn't unpickle anything
+    if MappedVectorStore.exists(index_path / MAPPED_DIR_NAME):
+        embeddings = create_embeddings()
+        # small child chunks get searched, answers get the spans of the big chunks around them
+        children = None
+        if MappedVectorStore.exists(index_path / CHILD_DIR_NAME):
+            children = MappedVectorStore(index_path / CHILD_DIR_NAME, embeddings)
+        return MappedVectorStore(index_path / MAPPED_DIR_NAME, embeddings, children=children)
+    if index_path.exists():
+        embeddings = create_embeddings()
+        return FAISS.load_local(str(index_path), embeddings, allow_dangerous_deserialization=True)
     return None
 
+@st.cache_resource
+def get_index_registry():
+    # one index per process shared by every session, reloaded when a build flips the version pointer
+    registry = IndexRegistry(
+        Path(__file__).parent.parent / "faiss_index",
+        load_faiss_index,
+        trigger_names=[POINTER_NAME],
+    )
+    registry.start_watching()
+    return registry
+
+@st.cache_resource
+def get_answer_cache():
+    return create_answer_cache()
+
+@st.cache_resource
+def get_upload_cache():
+    return create_upload_cache()
+
+def index_version():
+    # cached answers are only valid for the index version they were made with
+    faiss_path = Path(__file__).parent.parent / "faiss_index"
+    version = current_version(faiss_path)
+    if version is not None:
+        return version
+    # unversioned indexes get rebuilt in place, the files' modification times tell builds apart
+    files = [faiss_path / "index.faiss", faiss_path / "index.pkl", faiss_path / MAPPED_DIR_NAME / INFO_NAME]
+    stamps = [f.stat().st_mtime_ns for f in files if f.exists()]
+    return f"unversioned-{max(stamps)}" if stamps else "unversioned"
+
 def handle_subject_selection():
-    subjects = []
     documents_path = Path(__file__).parent.parent / "documents"
-    if documents_path.exists():
-        subjects = [f.name for f in documents_path.iterdir() if f.is_dir()]
+    catalog = get_document_catalog(documents_path)
+    subjects = catalog.subjects()
     
     if not subjects:
         st.sidebar.warning("No subjects found.")
         return
     
     selected_subject = st.sidebar.selectbox("Select Subject:", subjects)
+
+    # narrowing to one lecture needs the metadata index of the memory-mapped store
+    registry = get_index_registry()
+    selected_lecture = None
+    if isinstance(registry.get(), MappedVectorStore):
+        lectures = sorted(catalog.pdfs(selected_subject))
+        choice = st.sidebar.selectbox("Lecture:", ["All lectures"] + lectures)
+        if choice != "All lectures":
+            selected_lecture = choice
     
     if st.sidebar.button("Load Subject"):
         with st.spinner(f"Loading {selected_subject} materials..."):
 
             # Load the index
-            db = load_faiss_index()
-            if db:
-                # Filter for the selected subject
-                retriever = db.as_retriever(
-                    search_kwargs={
-                        "filter": {"subject": selected_subject}
-                    }
-                )
+            if registry.get() is not None:
+                # Filter for the selected subject, the retriever follows index reloads
+                search_filter = {"subject": selected_subject}
+                if selected_lecture:
+                    search_filter["lecture"] = selected_lecture
+                retriever = ParentChildRetriever(registry=registry, search_kwargs={"filter": search_filter})
                 st.session_state.qa_chain, st.session_state.memory = create_qa_chain(retriever)
-                st.sidebar.success(f"Loaded {selected_subject} materials!")
+                st.session_state.answer_scope = "|".join(f"{k}={v}" for k, v in sorted(search_filter.items()))
+                st.sidebar.success(f"Loaded {selected_lecture or selected_subject} materials!")
             else:
                 st.sidebar.error("Failed to load the document index.")
 
@@ -85,27 +160,115 @@ def handle_pdf_upload():
     if uploaded_file:
         # Check if it's a new file
         is_new_file = st.session_state.current_pdf_name != uploaded_file.name
+        data = uploaded_file.getvalue()
+        if is_new_file or st.session_state.upload_pages is None:
+            st.session_state.upload_pages = count_pdf_pages(data)
+        page_count = st.session_state.upload_pages
+
+        # big pdfs get indexed in the background, optionally only some of the pages
+        page_range = (0, page_count)
+        if page_count >= PROGRESSIVE_MIN_PAGES:
+            first, last = st.sidebar.slider("Pages to index:", 1, page_count, (1, page_count))
+            page_range = (first - 1, last)
+        range_changed = st.session_state.upload_range != page_range
         
-        # Process only if it's a new file or no database exists
-        if is_new_file or st.session_state.db is None:
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                tmp_path = tmp_file.name
-            
+        # Process only if it's a new file, a new page range or no database exists
+        # (unless this file already turned out to have no text, that won't change on a rerun)
+        if is_new_file or range_changed or (st.session_state.db is None and st.session_state.ingestion_status is None):
+            if st.session_state.ingestion is not None:
+                st.session_state.ingestion.cancel()
+                st.session_state.ingestion = None
+            st.session_state.ingestion_status = None
+            whole_file = page_range == (0, page_count)
+            key = content_key(data, EMBEDDING_KEY)
+            upload_cache = get_upload_cache()
+
             with st.spinner("Processing your PDF..."):
-                # Create new database and QA chain
-                st.session_state.db = load_single_pdf(tmp_path)
-                retriever = st.session_state.db.as_retriever()
+                # somebody may have uploaded the exact same file before
+                db = upload_cache.load(key, create_embeddings()) if whole_file else None
+                ingestion = None
+                if db is None:
+                    # parsed straight from the upload's buffer on a background thread, no temp file;
+                    # only the whole file is worth caching
+                    ingestion = ProgressiveIngestion(
+                        memoryview(data),
+                        create_embeddings(),
+                        *page_range,
+                        on_done=(lambda db: upload_cache.save(key, db)) if whole_file else None,
+                        source=uploaded_file.name,
+                    ).start()
+                    if page_count < PROGRESSIVE_MIN_PAGES:
+                        # small pdfs are quick, just wait for them
+                        ingestion.thread.join()
+                        if ingestion.error is not None:
+                            raise ingestion.error
+                        db = ingestion.db
+                        ingestion = None
+                        if db is None:
+                            # scanned pages or images only, nothing we could embed
+                            st.session_state.db = None
+                            st.session_state.qa_chain = None
+                            st.session_state.current_pdf_name = uploaded_file.name
+                            st.session_state.upload_range = page_range
+                            st.session_state.ingestion_status = NO_TEXT_STATUS
+                            st.sidebar.error(NO_TEXT_STATUS[1])
+                            return
+
+                if ingestion is not None:
+                    # searchable batch by batch
+                    st.session_state.ingestion = ingestion
+                    st.session_state.db = ingestion
+                    retriever = ingestion.as_retriever()
+                else:
+                    # Create new database and QA chain
+                    st.session_state.db = db
+                    retriever = st.session_state.db.as_retriever()
+
                 st.session_state.qa_chain, st.session_state.memory = create_qa_chain(retriever)
+                st.session_state.answer_scope = None
                 st.session_state.current_pdf_name = uploaded_file.name
+                st.session_state.upload_range = page_range
                 # Reset message history for new file
                 if is_new_file:
                     st.session_state.messages = []
                 
-            Path(tmp_path).unlink()  # Clean up the temporary file
-            st.sidebar.success("PDF processed successfully!")
+            if st.session_state.ingestion is None:
+                st.sidebar.success("PDF processed successfully!")
         # If same file is uploaded again, keep existing QA chain and memory
 
+        if st.session_state.ingestion is not None:
+            with st.sidebar:
+                show_ingestion_progress()
+        elif st.session_state.ingestion_status is not None:
+            kind, message = st.session_state.ingestion_status
+            getattr(st.sidebar, kind)(message)
+
+NO_TEXT_STATUS = ("error", "Couldn't find any text in this PDF, is it a scan?")
+
+def ingestion_status(ingestion):
+    if ingestion.error is not None:
+        return "error", f"Indexing failed after {ingestion.pages_done} pages: {ingestion.error}"
+    if ingestion.db is None:
+        return NO_TEXT_STATUS
+    return "success", f"PDF processed successfully! ({ingestion.pages_done} pages)"
+
+@st.fragment(run_every=1.0)
+def show_ingestion_progress():
+    # reruns on its own every second, the rest of the page stays put
+    ingestion = st.session_state.ingestion
+    if ingestion is None:
+        return
+    if ingestion.finished:
+        # stop polling: the full rerun no longer renders this fragment and shows the final status instead
+        st.session_state.ingestion = None
+        st.session_state.ingestion_status = ingestion_status(ingestion)
+        st.rerun()
+    total = ingestion.total_pages or 1
+    st.progress(
+        min(ingestion.pages_done / total, 1.0),
+        text=f"Indexed {ingestion.pages_done} / {total} pages, you can already ask about those",
+    )
+
 def handle_topic_learning():
     topic = st.sidebar.text_input("Enter the topic you want to learn:")
     start_learning = st.sidebar.button("Start Learning")
@@ -113,6 +276,7 @@ def handle_topic_learning():
     if start_learning and topic:
         if "qa_chain" not in st.session_state or st.session_state.current_topic != topic:
             st.session_state.qa_chain, st.session_state.memory = create_topic_qa_chain(topic)
+            st.session_state.answer_scope = None
             st.session_state.current_topic = topic
             st.session_state.messages = []  # Reset messages for new topic
             st.sidebar.success(f"Ready to help you learn {topic}!")
@@ -137,25 +301,46 @@ if st.session_state.get("qa_chain"):
             with st.chat_message(message["role"]):
                 st.markdown(message["content"])
         
-        # Show thinking message while generating response
+        # Stream the answer into the bubble as the tokens come in
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                try:
+            placeholder = st.empty()
+            placeholder.markdown("_Thinking..._")
+            handler = AnswerStreamHandler(lambda text: placeholder.markdown(text + "▌"))
+            try:
+                # Answers only get shared when they don't depend on this session's history
+                scope = st.session_state.answer_scope
+                cacheable = scope is not None and (
+                    not st.session_state.memory.chat_memory.messages or is_self_contained(prompt)
+                )
+                cached = None
+                if cacheable:
+                    store = get_index_registry().get()
+                    version = index_version()
+                    # on a miss the retriever embeds the same question again, straight from the embedding cache
+                    question_vector = store.embeddings.embed_query(prompt)
+                    cached = get_answer_cache().get(scope, version, question_vector)
+
+                if cached is not None:
+                    response_content = cached[0]
+                    st.session_state.memory.save_context({"question": prompt}, {"answer": response_content})
+                else:
                     # Generate response
                     input_key = "question" if doc_option in ["Select Subject", "Upload PDF"] else "input"
-                    response = st.session_state.qa_chain.invoke({input_key: prompt})
-                    # response = st.session_state.qa_chain({input_key: prompt})
-                    
-                    # Add assistant response to state
-                    response_content = response.get("answer", response.get("response", ""))
-                    st.session_state.messages.append(
-                        {"role": "assistant", "content": response_content}
+                    response = st.session_state.qa_chain.invoke(
+                        {input_key: prompt}, config={"callbacks": [handler]}
                     )
-                    
-                    # Force a rerun to update the display with the new response
-                    st.rerun()
-                except Exception as e:
-                    st.error(f"An error occurred while generating a response: {e}")
+                    response_content = response.get("answer", response.get("response", ""))
+                    if cacheable:
+                        get_answer_cache().put(scope, version, prompt, question_vector, response_content)
+                
+                # Add assistant response to state
+                placeholder.markdown(response_content)
+                st.session_state.messages.append(
+                    {"role": "assistant", "content": response_content}
+                )
+            except Exception as e:
+                placeholder.empty()
+                st.error(f"An error occurred while generating a response: {e}")
     else:
         # Display existing chat history when no new input
         for message in st.session_state.messages:
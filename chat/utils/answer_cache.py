@@ -0,0 +1,151 @@
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+# answers to near-identical first questions get reused across sessions for a while
+ANSWER_CACHE_PATH = os.getenv(
+    "ANSWER_CACHE_PATH", str(Path(__file__).parent.parent.parent / ".cache" / "answers.sqlite")
+)
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_HOURS = float(os.getenv("ANSWER_CACHE_TTL_HOURS", "168"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+
+
+def unit_vector(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class AnswerCache:
+    """
+    Stores answers by (scope, index version, question embedding).
+    A lookup returns the answer of the most similar cached question in the same scope and
+    index version, if its cosine similarity is at least `threshold` and it's younger than `ttl`.
+    Entries of other index versions are never returned and get purged on the next put;
+    past max_entries the least recently used ones go.
+    The vectors of a (scope, version) are kept as one matrix in memory, so a lookup is a
+    single matrix product. A cheap count / max id query tells when another process added
+    or removed entries and the matrix has to be reloaded.
+    """
+
+    def __init__(self, path, threshold=0.95, ttl=7 * 24 * 3600, max_entries=5000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # (scope, version, vector bytes) -> (stamp, ids, created, matrix)
+        self.matrices = {}
+        self.hits = 0
+        self.misses = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS answers (
+                    id INTEGER PRIMARY KEY,
+                    scope TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    answer TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS answers_scope ON answers (scope, version)")
+            conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _matrix(self, conn, scope, version, nbytes):
+        stamp = conn.execute(
+            "SELECT COUNT(*), MAX(id) FROM answers WHERE scope = ? AND version = ?", (scope, version)
+        ).fetchone()
+        key = (scope, version, nbytes)
+        with self.lock:
+            cached = self.matrices.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1:]
+        rows = conn.execute(
+            "SELECT id, created, vector FROM answers WHERE scope = ? AND version = ?", (scope, version)
+        ).fetchall()
+        # vectors of another embedding size can't be compared, skip them
+        rows = [row for row in rows if len(row[2]) == nbytes]
+        ids = np.asarray([row[0] for row in rows], dtype=np.int64)
+        created = np.asarray([row[1] for row in rows], dtype=np.float64)
+        if rows:
+            matrix = np.stack([np.frombuffer(row[2], dtype=np.float32) for row in rows])
+        else:
+            matrix = np.zeros((0, nbytes // 4), dtype=np.float32)
+        with self.lock:
+            self.matrices[key] = (stamp, ids, created, matrix)
+        return ids, created, matrix
+
+    def get(self, scope, version, vector):
+        """Returns (answer, similarity) of the best match, or None"""
+        query = unit_vector(vector)
+        now = time.time()
+        best = None
+        with self._connect() as conn:
+            ids, created, matrix = self._matrix(conn, scope, version, query.nbytes)
+            if len(ids):
+                # expired entries stay in the matrix until the next put purges them
+                similarities = np.where(created > now - self.ttl, matrix @ query, -np.inf)
+                i = int(np.argmax(similarities))
+                if similarities[i] >= self.threshold:
+                    row = conn.execute("SELECT answer FROM answers WHERE id = ?", (int(ids[i]),)).fetchone()
+                    if row is not None:
+                        best = row[0], float(similarities[i])
+                        conn.execute(
+                            "UPDATE answers SET last_used = ?, hits = hits + 1 WHERE id = ?", (now, int(ids[i]))
+                        )
+        with self.lock:
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return best
+
+    def put(self, scope, version, question, vector, answer):
+        now = time.time()
+        blob = unit_vector(vector).tobytes()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO answers (scope, version, question, vector, answer, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (scope, version, question, blob, answer, now, now),
+            )
+            # a new index version means answers built on the old one may be wrong now
+            conn.execute("DELETE FROM answers WHERE version != ? OR created <= ?", (version, now - self.ttl))
+            count = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            if count > self.max_entries:
+                conn.execute(
+                    "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+        with self.lock:
+            # the put may have purged or evicted entries of any scope
+            self.matrices.clear()
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM answers")
+        with self.lock:
+            self.matrices.clear()
+
+
+def create_answer_cache():
+    return AnswerCache(
+        ANSWER_CACHE_PATH,
+        threshold=ANSWER_CACHE_THRESHOLD,
+        ttl=ANSWER_CACHE_TTL_HOURS * 3600,
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+    )
@@ -0,0 +1,309 @@
+"""
+Compares the search index types on the current index (or a copy of it blown up with --scale).
+
+    python -m chat.utils.benchmark_index --k 4 --queries 200
+    python -m chat.utils.benchmark_index --scale 10 --types flat ivf hnsw
+
+With --compression it instead compares shortened / quantized vector storage against
+the full float32 vectors, overall and per subject:
+
+    python -m chat.utils.benchmark_index --compression --dims 256 1024 --storages float32 sq8 pq
+
+With --children it compares answering from whole chunks with answering from the parent
+spans around child chunk hits: how often the right chunk makes it into the context, and
+how many tokens that context costs.
+
+Queries are stored chunk vectors plus a bit of noise, so no embedding calls are made.
+Recall@k is measured against the exact flat search over the full vectors.
+"""
+import argparse
+import itertools
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from .index_versions import current_version_path
+from .mapped_index import (
+    ANN_NAME,
+    ANN_TYPES,
+    CODES_NAME,
+    DEFAULT_ANN_PARAMS,
+    MAPPED_DIR_NAME,
+    STORAGE_TYPES,
+    MappedVectorStore,
+    build_ann_index,
+    write_mapped_index,
+)
+from .parent_child import CHILD_DIR_NAME, CONTEXT_TOKEN_BUDGET, count_tokens, parent_child_search
+
+
+def make_scaled_copy(source, target, scale, seed=0):
+    """Writes a copy of a mapped index with `scale` noisy copies of every vector"""
+    store = MappedVectorStore(source, None)
+    rng = np.random.default_rng(seed)
+    vectors = store.rows(0, len(store))
+    spread = vectors.std() * 0.05
+    copies = [vectors] + [
+        vectors + rng.normal(0, spread, vectors.shape).astype(np.float32) for _ in range(scale - 1)
+    ]
+    metadatas = [store.get_record(i)["metadata"] for i in range(len(store))]
+    docs = [Document(page_content="", metadata=metadata) for _ in range(scale) for metadata in metadatas]
+    ids = [str(i) for i in range(len(docs))]
+    write_mapped_index(target, ids, np.concatenate(copies), docs, store.info["embedding_model"])
+
+
+def make_queries(store, count, seed=1, return_positions=False):
+    rng = np.random.default_rng(seed)
+    picks = np.sort(rng.choice(len(store), size=min(count, len(store)), replace=False))
+    queries = store.rows_at(picks)
+    queries = queries + rng.normal(0, queries.std() * 0.1, queries.shape).astype(np.float32)
+    return (queries, picks) if return_positions else queries
+
+
+def index_bytes(path, index_type):
+    if index_type == "flat":
+        return vector_bytes(path)
+    return (path / ANN_NAME).stat().st_size
+
+
+def vector_bytes(path):
+    # whatever the flat scan reads, in any storage format
+    names = ("vectors.npy", CODES_NAME)
+    return sum((path / name).stat().st_size for name in names if (path / name).exists())
+
+
+def run_queries(store, queries, k, search_filter=None, **kwargs):
+    latencies = []
+    results = []
+    for query in queries:
+        started = time.perf_counter()
+        hits = store.similarity_search_with_score_by_vector(query, k, filter=search_filter, **kwargs)
+        latencies.append(time.perf_counter() - started)
+        results.append([doc.id for doc, _ in hits])
+    return results, np.asarray(latencies) * 1000
+
+
+def recall_at_k(results, truth, k):
+    found = sum(len(set(r) & set(t[:k])) for r, t in zip(results, truth))
+    expected = sum(min(k, len(t)) for t in truth)
+    return found / expected if expected else 1.0
+
+
+def benchmark(source, types, params, k=4, query_count=200, scale=1, search_filter=None):
+    workdir = Path(tempfile.mkdtemp(prefix="index-bench-"))
+    try:
+        base = workdir / "base"
+        if scale > 1:
+            make_scaled_copy(source, base, scale)
+        else:
+            shutil.copytree(source, base)
+            (base / ANN_NAME).unlink(missing_ok=True)
+            build_ann_index(base, "flat")
+
+        exact_store = MappedVectorStore(base, None)
+        queries = make_queries(exact_store, query_count)
+        truth, _ = run_queries(exact_store, queries, k, search_filter, exact=True)
+        print(f"{len(exact_store)} vectors x {exact_store.info['dimensions']} dims, "
+              f"{len(queries)} queries, k={k}, filter={search_filter}")
+
+        rows = []
+        for index_type in types:
+            path = workdir / index_type
+            shutil.copytree(base, path)
+            started = time.perf_counter()
+            build_ann_index(path, index_type, **params)
+            build_seconds = time.perf_counter() - started
+            store = MappedVectorStore(path, None)
+            run_queries(store, queries[:10], k, search_filter)  # warm up
+            results, latencies = run_queries(store, queries, k, search_filter)
+            rows.append({
+                "type": index_type,
+                "factory": store.info.get("ann", {}).get("factory", "numpy scan"),
+                "recall": recall_at_k(results, truth, k),
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p99_ms": float(np.percentile(latencies, 99)),
+                "bytes": index_bytes(path, index_type),
+                "build_s": build_seconds,
+            })
+        return rows
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def benchmark_compression(source, configs, params, k=4, query_count=200):
+    """
+    Rebuilds the index once per (dimensions, storage) config and measures what it costs
+    in recall against the full float32 vectors, for all chunks and for every subject.
+    """
+    workdir = Path(tempfile.mkdtemp(prefix="index-bench-"))
+    try:
+        base = MappedVectorStore(source, None)
+        if base.storage != "float32" or base.info.get("project_dims"):
+            print("Note: the source index is already shortened or quantized, recall is relative to it")
+        vectors = base.rows(0, len(base))
+        records = [base.get_record(i) for i in range(len(base))]
+        ids = [record["id"] for record in records]
+        docs = [Document(page_content=record["page_content"], metadata=record["metadata"]) for record in records]
+        queries = make_queries(base, query_count)
+        subjects = base.values("subject")
+        truth = {None: run_queries(base, queries, k, exact=True)[0]}
+        for subject in subjects:
+            truth[subject] = run_queries(base, queries, k, {"subject": subject}, exact=True)[0]
+        print(f"{len(base)} vectors x {base.info['dimensions']} dims, {len(queries)} queries, k={k}")
+
+        full_bytes = vector_bytes(source)
+        rows = []
+        for dims, storage in configs:
+            path = workdir / f"{storage}-{dims or 'full'}"
+            write_mapped_index(path, ids, vectors, docs, base.info["embedding_model"],
+                               project_dims=dims, storage=storage, storage_params=params)
+            store = MappedVectorStore(path, None)
+            run_queries(store, queries[:10], k, exact=True)  # warm up
+            results, latencies = run_queries(store, queries, k, exact=True)
+            per_subject = {
+                subject: recall_at_k(run_queries(store, queries, k, {"subject": subject}, exact=True)[0],
+                                     truth[subject], k)
+                for subject in subjects
+            }
+            rows.append({
+                "config": f"{storage} @ {dims or base.info['dimensions']}d",
+                "recall": recall_at_k(results, truth[None], k),
+                "subjects": per_subject,
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "bytes": vector_bytes(path),
+                "ratio": full_bytes / max(vector_bytes(path), 1),
+            })
+        return rows
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_compression_rows(rows, k):
+    print(f"{'config':<18} {f'recall@{k}':>9} {'worst subj':>10} {'p50 ms':>8} {'MB':>9} {'smaller':>8}")
+    for row in rows:
+        worst = min(row["subjects"].values()) if row["subjects"] else row["recall"]
+        print(
+            f"{row['config']:<18} {row['recall']:>9.3f} {worst:>10.3f} {row['p50_ms']:>8.2f} "
+            f"{row['bytes'] / 1024 ** 2:>9.2f} {row['ratio']:>7.1f}x"
+        )
+    if rows and rows[0]["subjects"]:
+        subjects = list(rows[0]["subjects"])
+        print()
+        print(f"{'per subject':<18} " + " ".join(f"{subject[:12]:>12}" for subject in subjects))
+        for row in rows:
+            print(f"{row['config']:<18} " + " ".join(f"{row['subjects'][s]:>12.3f}" for s in subjects))
+
+
+def benchmark_parent_child(version_path, k=4, query_count=200, token_budget=CONTEXT_TOKEN_BUDGET, child_k=12):
+    """
+    Queries are noisy child chunk vectors, the right answer is the chunk the child was cut from.
+    Hit rate is how often that chunk (or a span of it) ends up in the context.
+    """
+    children = MappedVectorStore(version_path / CHILD_DIR_NAME, None)
+    parents = MappedVectorStore(version_path / MAPPED_DIR_NAME, None, children=children)
+    queries, picks = make_queries(children, query_count, return_positions=True)
+    expected = [children.get_record(int(p))["metadata"]["parent_id"] for p in picks]
+    subjects = [children.get_record(int(p))["metadata"].get("subject") for p in picks]
+    print(f"{len(parents)} chunks / {len(children)} child chunks, {len(queries)} queries")
+
+    searches = {
+        f"whole chunks, k={k}": lambda query: parents.similarity_search_by_vector(query, k),
+        f"child spans, {token_budget or f'k={k}'} tok": lambda query: parent_child_search(
+            parents, query, child_k=child_k, token_budget=token_budget, k=k),
+    }
+    rows = []
+    for name, search in searches.items():
+        hits, tokens, latencies = [], [], []
+        for query, parent_id in zip(queries, expected):
+            started = time.perf_counter()
+            docs = search(query)
+            latencies.append((time.perf_counter() - started) * 1000)
+            hits.append(any(doc.id == parent_id for doc in docs))
+            tokens.append(sum(count_tokens(doc.page_content) for doc in docs))
+        per_subject = {}
+        for subject, hit in zip(subjects, hits):
+            per_subject.setdefault(subject, []).append(hit)
+        rows.append({
+            "config": name,
+            "hit_rate": float(np.mean(hits)),
+            "subjects": {subject: float(np.mean(h)) for subject, h in sorted(per_subject.items())},
+            "tokens": float(np.mean(tokens)),
+            "p50_ms": float(np.percentile(latencies, 50)),
+        })
+    return rows
+
+
+def print_parent_child_rows(rows):
+    print(f"{'context':<24} {'hit rate':>8} {'worst subj':>10} {'avg tokens':>10} {'p50 ms':>8}")
+    for row in rows:
+        worst = min(row["subjects"].values())
+        print(f"{row['config']:<24} {row['hit_rate']:>8.3f} {worst:>10.3f} {row['tokens']:>10.0f} {row['p50_ms']:>8.2f}")
+
+
+def print_rows(rows, k):
+    print(f"{'type':<7} {'factory':<18} {f'recall@{k}':>9} {'p50 ms':>8} {'p99 ms':>8} {'MB':>9} {'build s':>8}")
+    for row in rows:
+        print(
+            f"{row['type']:<7} {row['factory']:<18} {row['recall']:>9.3f} {row['p50_ms']:>8.2f} "
+            f"{row['p99_ms']:>8.2f} {row['bytes'] / 1024 ** 2:>9.2f} {row['build_s']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall / latency / size of the search index types")
+    parser.add_argument("--index", default=None, help="mapped index dir, defaults to the published version")
+    parser.add_argument("--types", nargs="+", choices=ANN_TYPES, default=list(ANN_TYPES))
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--scale", type=int, default=1, help="benchmark on N noisy copies of the corpus")
+    parser.add_argument("--subject", default=None, help="also filter every query to this subject")
+    parser.add_argument("--compression", action="store_true",
+                        help="compare shortened / quantized vector storage instead of index types")
+    parser.add_argument("--dims", nargs="+", type=int, default=[256, 512, 1024],
+                        help="with --compression, dimensions to shorten the vectors to")
+    parser.add_argument("--storages", nargs="+", choices=STORAGE_TYPES, default=list(STORAGE_TYPES))
+    parser.add_argument("--children", action="store_true",
+                        help="compare whole chunk context with parent spans around child chunk hits")
+    parser.add_argument("--token-budget", type=int, default=CONTEXT_TOKEN_BUDGET,
+                        help="cap on context tokens, by default spans cost at most what k whole chunks do")
+    for name, default in DEFAULT_ANN_PARAMS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default)
+    args = parser.parse_args()
+
+    source = args.index
+    if source is None:
+        faiss_path = Path(__file__).parent.parent.parent / "faiss_index"
+        version_path = current_version_path(faiss_path)
+        if version_path is None:
+            raise SystemExit("No published index found, run build_index first")
+        source = version_path / MAPPED_DIR_NAME
+
+    params = {name: getattr(args, name) for name in DEFAULT_ANN_PARAMS}
+    if args.children:
+        rows = benchmark_parent_child(Path(source).parent, k=args.k, query_count=args.queries,
+                                      token_budget=args.token_budget)
+        print_parent_child_rows(rows)
+        raise SystemExit(0)
+    if args.compression:
+        configs = [(None, "float32")] + [
+            config for config in itertools.product([None] + args.dims, args.storages)
+            if config != (None, "float32")
+        ]
+        rows = benchmark_compression(Path(source), configs, params, k=args.k, query_count=args.queries)
+        print_compression_rows(rows, args.k)
+        raise SystemExit(0)
+
+    rows = benchmark(
+        Path(source),
+        args.types,
+        params,
+        k=args.k,
+        query_count=args.queries,
+        scale=args.scale,
+        search_filter={"subject": args.subject} if args.subject else None,
+    )
+    print_rows(rows, args.k)
@@ -1,23 +1,204 @@
+import argparse
 from pathlib import Path
-from .document_loader import load_folder_documents
+from langchain_community.vectorstores import FAISS
+from .document_loader import (
+    EMBEDDING_KEY,
+    create_embeddings,
+    list_subject_pdfs,
+    load_pdf_chunks,
+    load_pdfs_parallel,
+)
+from .index_manifest import (
+    chunk_ids_for,
+    diff_manifest,
+    empty_manifest,
+    hash_file,
+    load_manifest,
+    refresh_vector_ids,
+    save_manifest,
+)
+from .index_versions import current_version_path, publish_version, start_version
+from .mapped_index import (
+    ANN_TYPES,
+    DEFAULT_ANN_PARAMS,
+    MAPPED_DIR_NAME,
+    STORAGE_TYPES,
+    MappedVectorStore,
+    build_ann_index,
+    export_faiss_db,
+    index_settings,
+)
+from .parent_child import CHILD_DIR_NAME, build_child_index
 
-def build_and_save_index():
+def load_existing_index(faiss_path, embeddings):
+    """Loads the current index and its manifest, or (None, None) if we have to start over"""
+    # before versions existed the index lived directly in faiss_index/
+    faiss_path = current_version_path(faiss_path) or faiss_path
+    manifest = load_manifest(faiss_path)
+    if manifest is None or manifest.get("embedding_model") != EMBEDDING_KEY:
+        # no manifest means an old style index, we can't tell which vectors belong to which pdf
+        return None, None
+    if not (Path(faiss_path) / "index.faiss").exists():
+        return None, None
+    db = FAISS.load_local(str(faiss_path), embeddings, allow_dangerous_deserialization=True)
+    return db, manifest
+
+def update_index(db, manifest, documents_path, embeddings, workers=None, pages_per_task=None):
+    """
+    Brings the index in line with the pdfs under documents_path.
+    Only new or changed pdfs get parsed and embedded, vectors of deleted pdfs get dropped.
+    With workers > 1 the changed pdfs are parsed in a process pool.
+    Returns (db, stats).
+    """
+    documents_path = Path(documents_path)
+    pdfs = {
+        pdf_path.relative_to(documents_path).as_posix(): (subject, pdf_path)
+        for subject, pdf_path in list_subject_pdfs(documents_path)
+    }
+    current_hashes = {rel_path: hash_file(pdf_path) for rel_path, (_, pdf_path) in pdfs.items()}
+    changed, deleted = diff_manifest(manifest, current_hashes)
+
+    # drop the old vectors of everything that changed or disappeared
+    stale_ids = []
+    for rel_path in changed + deleted:
+        if rel_path in manifest["files"]:
+            stale_ids.extend(manifest["files"].pop(rel_path)["chunk_ids"])
+    if stale_ids and db is not None:
+        db.delete(stale_ids)
+
+    if workers and workers > 1 and changed:
+        print(f"Parsing {len(changed)} pdfs with {workers} workers...")
+        parsed = load_pdfs_parallel([pdfs[rel_path] for rel_path in changed], workers, pages_per_task)
+    else:
+        parsed = (load_pdf_chunks(pdfs[rel_path][1], pdfs[rel_path][0]) for rel_path in changed)
+
+    added_chunks = 0
+    for rel_path, chunks in zip(changed, parsed):
+        subject, pdf_path = pdfs[rel_path]
+        print(f"Indexing {rel_path}...")
+        ids = chunk_ids_for(rel_path, current_hashes[rel_path], len(chunks))
+        # pdfs without extractable text still get an entry, so the next run sees them as unchanged
+        if chunks and db is None:
+            db = FAISS.from_documents(chunks, embeddings, ids=ids)
+        elif chunks:
+            db.add_documents(chunks, ids=ids)
+        manifest["files"][rel_path] = {
+            "hash": current_hashes[rel_path],
+            "subject": subject,
+            "chunk_ids": ids,
+        }
+        added_chunks += len(chunks)
+
+    stats = {
+        "changed": len(changed),
+        "deleted": len(deleted),
+        "unchanged": len(current_hashes) - len(changed),
+        "added_chunks": added_chunks,
+        "removed_chunks": len(stale_ids),
+    }
+    return db, stats
+
+def build_and_save_index(full_rebuild=False, workers=None, pages_per_task=None, keep_versions=3,
+                         index_type="flat", index_params=None, project_dims=None, storage="float32"):
     try:
         # Get paths relative to project root
         root_path = Path(__file__).parent.parent.parent
         documents_path = root_path / "documents"
         faiss_path = root_path / "faiss_index"
-        
-        # Load all documents and create FAISS index
-        print(f"Loading documents from {documents_path}...")
-        db = load_folder_documents(documents_path)
-        
-        # Save the index
-        print("Saving FAISS index...")
-        db.save_local(str(faiss_path))
-        
+
+        embeddings = create_embeddings()
+        db, manifest = (None, None) if full_rebuild else load_existing_index(faiss_path, embeddings)
+        if manifest is None:
+            print("Building the FAISS index from scratch...")
+            manifest = empty_manifest(EMBEDDING_KEY)
+
+        print(f"Checking documents in {documents_path}...")
+        db, stats = update_index(db, manifest, documents_path, embeddings, workers, pages_per_task)
+        print(
+            f"{stats['changed']} new/changed, {stats['deleted']} deleted, {stats['unchanged']} unchanged pdfs "
+            f"(+{stats['added_chunks']} / -{stats['removed_chunks']} chunks)"
+        )
+        if stats["added_chunks"]:
+            print(embeddings.report())
+
+        if db is None or not manifest["files"]:
+            raise ValueError(f"No PDFs found in {documents_path} :(")
+
+        current_path = current_version_path(faiss_path)
+        up_to_date = (
+            current_path is not None
+            and MappedVectorStore.exists(current_path / MAPPED_DIR_NAME)
+            and MappedVectorStore.exists(current_path / CHILD_DIR_NAME)
+        )
+        # pq storage reuses the pq_m / pq_bits settings of the ann index
+        wanted_params = {**DEFAULT_ANN_PARAMS, **(index_params or {})}
+        storage_params = {k: wanted_params[k] for k in ("pq_m", "pq_bits")} if storage == "pq" else {}
+        if up_to_date:
+            # switching the search index type or the vector storage also needs a new version
+            current = index_settings(current_path / MAPPED_DIR_NAME)
+            up_to_date = (
+                current["index_type"] == index_type
+                and (index_type == "flat"
+                     or all(current["index_params"].get(k) == v for k, v in wanted_params.items()))
+                and current["project_dims"] == project_dims
+                and current["storage"] == storage
+                and current["storage_params"] == storage_params
+            )
+        if not stats["changed"] and not stats["deleted"] and up_to_date:
+            print("Index is already up to date.")
+            return
+
+        # everything goes into a fresh version directory, running apps only
+        # see it once the pointer flips at the end
+        version, staging = start_version(faiss_path)
+        print(f"Saving FAISS index version {version}...")
+        db.save_local(str(staging))
+        refresh_vector_ids(manifest, db)
+        save_manifest(staging, manifest)
+
+        # the chat app reads this copy, it memory-maps the vectors instead of unpickling everything
+        print("Writing memory-mapped index...")
+        export_faiss_db(db, staging / MAPPED_DIR_NAME, EMBEDDING_KEY, project_dims, storage, storage_params)
+        # small chunks to match questions against precisely, see parent_child
+        print("Writing child chunk index...")
+        child_count = build_child_index(staging / MAPPED_DIR_NAME, staging / CHILD_DIR_NAME, embeddings,
+                                        EMBEDDING_KEY, project_dims, storage, storage_params)
+        print(f"{child_count} child chunks")
+        if index_type != "flat":
+            print(f"Building {index_type} search index...")
+            build_ann_index(staging / MAPPED_DIR_NAME, index_type, **(index_params or {}))
+            build_ann_index(staging / CHILD_DIR_NAME, index_type, **(index_params or {}))
+
+        publish_version(faiss_path, version, staging, keep=keep_versions,
+                        extra={"embedding_model": EMBEDDING_KEY, "stats": stats})
+        print(f"Published index version {version}")
+
     except Exception as e:
         print(f"Error building index: {str(e)}")
 
 if __name__ == "__main__":
-    build_and_save_index()
+    parser = argparse.ArgumentParser(description="Build or update the FAISS index for documents/")
+    parser.add_argument("--full", action="store_true", help="ignore the manifest and re-embed everything")
+    parser.add_argument("--workers", type=int, default=None, help="parse pdfs in a pool of this many processes")
+    parser.add_argument("--pages-per-task", type=int, default=None,
+                        help="with --workers, split pdfs longer than this into page ranges")
+    parser.add_argument("--keep", type=int, default=3, help="how many published versions to keep for rollback")
+    parser.add_argument("--index-type", choices=ANN_TYPES, default="flat",
+                        help="flat scans every vector exactly, the others are approximate but sub-linear")
+    parser.add_argument("--project-dims", type=int, default=None,
+                        help="shorten the stored vectors to this many dimensions (the faiss copy keeps them all)")
+    parser.add_argument("--storage", choices=STORAGE_TYPES, default="float32",
+                        help="sq8 stores 1 byte per dimension, pq pq_m bytes per vector")
+    for name, default in DEFAULT_ANN_PARAMS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default)
+    args = parser.parse_args()
+    build_and_save_index(
+        full_rebuild=args.full,
+        workers=args.workers,
+        pages_per_task=args.pages_per_task,
+        keep_versions=args.keep,
+        index_type=args.index_type,
+        index_params={name: getattr(args, name) for name in DEFAULT_ANN_PARAMS},
+        project_dims=args.project_dims,
+        storage=args.storage,
+    )
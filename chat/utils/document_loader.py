@@ -1,16 +1,49 @@
 from langchain_community.document_loaders import DirectoryLoader, PyPDFLoader
+# PyPDFParser's own metadata cleanup, so our pages carry exactly what PyPDFLoader's do
+from langchain_community.document_loaders.parsers.pdf import _purge_metadata
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain.docstore.document import Document
+from concurrent.futures import ProcessPoolExecutor
+from pypdf import PdfReader
+import io
 import os
 from pathlib import Path
 from dotenv import load_dotenv
+from .embedding_cache import CachedEmbeddings, EmbeddingCache
+from .embedding_scheduler import EmbeddingScheduler
 
 load_dotenv()
 
+EMBEDDING_MODEL = "text-embedding-3-large"
+# ask the api for shortened vectors (e.g. 1024 instead of 3072), empty means full size
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS") or 0) or None
+# indexes and cached vectors are only reusable with the same model and dimensions
+EMBEDDING_KEY = f"{EMBEDDING_MODEL}@{EMBEDDING_DIMENSIONS}" if EMBEDDING_DIMENSIONS else EMBEDDING_MODEL
+# how hard index builds may push the embeddings api, tune these to your account's limits
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", "1000000"))
+# every chunk we ever embedded, shared by the index builds and the pdf uploads
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", str(Path(__file__).parent.parent.parent / ".cache" / "embeddings.sqlite")
+)
+EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "2048"))
+
 def create_embeddings():
-    return OpenAIEmbeddings(model="text-embedding-3-large")
+    # retries are done by the scheduler, so the client itself shouldn't retry
+    client = OpenAIEmbeddings(
+        model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS, chunk_size=EMBEDDING_BATCH_SIZE, max_retries=0
+    )
+    scheduler = EmbeddingScheduler(
+        client,
+        batch_size=EMBEDDING_BATCH_SIZE,
+        max_concurrency=EMBEDDING_CONCURRENCY,
+        tokens_per_minute=EMBEDDING_TOKENS_PER_MINUTE,
+    )
+    cache = EmbeddingCache(EMBEDDING_CACHE_PATH, max_bytes=EMBEDDING_CACHE_MAX_MB * 1024 ** 2)
+    return CachedEmbeddings(scheduler, cache, model_key=EMBEDDING_KEY)
 
 def get_text_splitter():
     # this splits text into chunks
@@ -21,14 +54,26 @@ def get_text_splitter():
         is_separator_regex=False,
     )
 
-def load_folder_documents(folder_path):
+def load_folder_documents(folder_path, workers=None, pages_per_task=None):
     """
     Goes through a folder of PDFs organized by subject and loads them into a vector db.
+    Pass workers > 1 to parse the pdfs in a process pool (see load_pdfs_parallel).
     """
     folder_path = Path(folder_path)
     if not folder_path.exists():
         raise ValueError(f"Hey, this folder doesn't exist: {folder_path}")
 
+    if workers and workers > 1:
+        jobs = list_subject_pdfs(folder_path)
+        all_docs = [
+            chunk
+            for chunks in load_pdfs_parallel(jobs, workers=workers, pages_per_task=pages_per_task)
+            for chunk in chunks
+        ]
+        if not all_docs:
+            raise ValueError(f"No PDFs found in {folder_path} :(")
+        return FAISS.from_documents(all_docs, create_embeddings())
+
     all_docs = []
     text_splitter = get_text_splitter()
     
@@ -62,19 +107,129 @@ def load_folder_documents(folder_path):
     db = FAISS.from_documents(all_docs, embeddings)
     return db
 
+def list_subject_pdfs(folder_path):
+    """
+    Lists (subject, pdf_path) pairs for every pdf under the subject folders,
+    in the same order the DirectoryLoader would pick them up.
+    """
+    folder_path = Path(folder_path)
+    pdfs = []
+    for subject_folder in folder_path.iterdir():
+        if subject_folder.is_dir():
+            for pdf_path in subject_folder.glob("**/*.pdf"):
+                # DirectoryLoader skips hidden files and folders
+                relative_parts = pdf_path.relative_to(subject_folder).parts
+                if pdf_path.is_file() and not any(part.startswith(".") for part in relative_parts):
+                    pdfs.append((subject_folder.name, pdf_path))
+    return pdfs
+
+def load_pdf_chunks(pdf_path, subject):
+    """
+    Loads one pdf from a subject folder and splits it, with the same metadata
+    load_folder_documents gives it.
+    """
+    return _load_page_range(pdf_path, subject, 0, None)
+
+def pdf_bytes(pdf):
+    """bytes of an in-memory pdf, without copying a memoryview over a whole bytes object"""
+    if isinstance(pdf, memoryview):
+        if isinstance(pdf.obj, bytes) and pdf.nbytes == len(pdf.obj):
+            return pdf.obj
+        return pdf.tobytes()
+    return bytes(pdf)
+
+def is_in_memory(pdf):
+    return isinstance(pdf, (bytes, bytearray, memoryview))
+
+def open_pdf(pdf):
+    # BytesIO over bytes shares the buffer until someone writes to it, so this doesn't copy
+    return PdfReader(io.BytesIO(pdf_bytes(pdf)) if is_in_memory(pdf) else str(pdf))
+
+def count_pdf_pages(pdf):
+    """Page count of a pdf (path, bytes or memoryview), without extracting any text"""
+    return len(open_pdf(pdf).pages)
+
+def iter_pdf_pages(pdf, start=0, stop=None, source=None):
+    """
+    Yields pages [start, stop) of a pdf one at a time, the way PyPDFLoader would
+    load them, without extracting the rest.
+    pdf can be a path or the file's bytes / a memoryview of them (an upload), then
+    nothing touches the disk and `source` is what ends up in the metadata.
+    """
+    reader = open_pdf(pdf)
+    # the document level metadata PyPDFLoader puts on every page, from the same reader
+    shared_metadata = _purge_metadata(
+        {"producer": "PyPDF", "creator": "PyPDF", "creationdate": ""}
+        | dict(reader.metadata or {})
+        | {
+            "source": (source or "upload.pdf") if is_in_memory(pdf) else str(pdf),
+            "total_pages": len(reader.pages),
+        }
+    )
+    stop = len(reader.pages) if stop is None else min(stop, len(reader.pages))
+    for page_number in range(start, stop):
+        text = reader.pages[page_number].extract_text().strip()
+        metadata = dict(shared_metadata)
+        metadata["page"] = page_number
+        metadata["page_label"] = reader.page_labels[page_number]
+        yield Document(page_content=text, metadata=metadata)
+
+def _load_page_range(pdf_path, subject, start, stop):
+    """
+    Loads and splits pages [start, stop) of a subject pdf. Runs inside a worker process.
+    """
+    docs = list(iter_pdf_pages(pdf_path, start, stop))
+    for doc in docs:
+        doc.metadata["subject"] = subject
+        doc.metadata["document_type"] = "content"
+
+    return get_text_splitter().split_documents(docs)
+
+def _load_pdf_task(pdf_path, subject, page_range):
+    if page_range is None:
+        return load_pdf_chunks(pdf_path, subject)
+    return _load_page_range(pdf_path, subject, *page_range)
+
+def load_pdfs_parallel(jobs, workers=None, pages_per_task=None):
+    """
+    Parses and splits (subject, pdf_path) jobs in a process pool.
+    Pdfs with more than pages_per_task pages are cut into page ranges so one huge
+    file doesn't end up on a single core. Returns one list of chunks per job, in job
+    order, matching what load_pdf_chunks gives for each pdf.
+    """
+    tasks = []
+    for job_index, (subject, pdf_path) in enumerate(jobs):
+        page_count = len(PdfReader(str(pdf_path)).pages) if pages_per_task else 0
+        if pages_per_task and page_count > pages_per_task:
+            for start in range(0, page_count, pages_per_task):
+                stop = min(start + pages_per_task, page_count)
+                tasks.append((job_index, pdf_path, subject, (start, stop)))
+        else:
+            tasks.append((job_index, pdf_path, subject, None))
+
+    results = [[] for _ in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            (job_index, pool.submit(_load_pdf_task, pdf_path, subject, page_range))
+            for job_index, pdf_path, subject, page_range in tasks
+        ]
+        # tasks were queued in page order, so extending in submit order keeps chunk order
+        for job_index, future in futures:
+            results[job_index].extend(future.result())
+
+    return results
+
 def load_single_pdf(pdf_path):
 
     pdf_path = Path(pdf_path)
     if not pdf_path.exists():
         raise ValueError(f"Can't find this PDF: {pdf_path}")
     
-    # Load the PDF
-    loader = PyPDFLoader(str(pdf_path))
-    docs = loader.load()
+    # Load the PDF, same page extraction as the index builds
+    docs = list(iter_pdf_pages(pdf_path))
     
     # Add metadata to documents
     for doc in docs:
-        doc.metadata["source"] = str(pdf_path)
         doc.metadata["document_type"] = "content"
     
     text_splitter = get_text_splitter()
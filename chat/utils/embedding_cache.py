@@ -0,0 +1,192 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def normalize_text(text):
+    # same text with different unicode forms or whitespace should hit the same entry
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_key(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    On-disk embedding store keyed by (model, hash of the normalized text).
+    Least recently used entries get evicted once the stored vectors pass max_bytes.
+    Safe to share between threads and processes (every call opens its own sqlite connection).
+    """
+
+    def __init__(self, path, max_bytes=2 * 1024 ** 3):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # counters for this process, the cumulative ones live in the db
+        self.hits = 0
+        self.misses = 0
+        self.saved_chars = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_many(self, model, keys):
+        """Returns {key: vector} for the keys that are cached"""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._connect() as conn:
+            # sqlite has a limit on query parameters, so look them up in slices
+            for i in range(0, len(unique_keys), 500):
+                batch = unique_keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, key) for key in found],
+                )
+        return found
+
+    def put_many(self, model, items):
+        """Stores (key, vector) pairs and evicts old entries if we're over the size limit"""
+        now = time.time()
+        rows = []
+        for key, vector in items:
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((model, key, blob, len(blob), now))
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # drop the least recently used entries until we're back under 90% of the limit
+        to_free = total - int(self.max_bytes * 0.9)
+        freed = 0
+        stale = []
+        for model, key, size in conn.execute("SELECT model, text_hash, size FROM embeddings ORDER BY last_used"):
+            stale.append((model, key))
+            freed += size
+            if freed >= to_free:
+                break
+        conn.executemany("DELETE FROM embeddings WHERE model = ? AND text_hash = ?", stale)
+
+    def record(self, hits, misses, saved_chars):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+            self.saved_chars += saved_chars
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO counters (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                [("hits", hits), ("misses", misses), ("saved_chars", saved_chars)],
+            )
+
+    def stats(self):
+        """Hit counts for this process and for the cache's whole lifetime"""
+        with self._connect() as conn:
+            totals = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings").fetchone()
+        lookups = self.hits + self.misses
+        total_lookups = totals.get("hits", 0) + totals.get("misses", 0)
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_chars": self.saved_chars,
+            "total_hits": totals.get("hits", 0),
+            "total_misses": totals.get("misses", 0),
+            "total_hit_rate": totals.get("hits", 0) / total_lookups if total_lookups else 0.0,
+            "total_saved_chars": totals.get("saved_chars", 0),
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings that look in an EmbeddingCache first and only send the misses to the wrapped embeddings.
+    model_key should change whenever the vectors would (different model, different dimensions...).
+    """
+
+    def __init__(self, embeddings, cache, model_key):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_key = model_key
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        keys = [text_key(text) for text in texts]
+        cached = self.cache.get_many(self.model_key, keys)
+
+        # embed each missing text once, even if it shows up several times
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_entries = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model_key, new_entries.items())
+            cached.update(new_entries)
+
+        saved_chars = sum(len(text) for key, text in zip(keys, texts) if key not in missing)
+        self.cache.record(len(texts) - len(missing), len(missing), saved_chars)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text):
+        # openai embeds queries and documents the same way, so they share cache entries
+        key = text_key(text)
+        cached = self.cache.get_many(self.model_key, [key])
+        if key in cached:
+            self.cache.record(1, 0, len(text))
+            return cached[key]
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many(self.model_key, [(key, vector)])
+        self.cache.record(0, 1, 0)
+        return vector
+
+    def report(self):
+        s = self.cache.stats()
+        lines = [
+            f"Embedding cache: {s['hits']} hits / {s['misses']} misses ({s['hit_rate']:.0%}), "
+            f"~{s['saved_chars'] // 4} tokens not re-embedded; lifetime hit rate {s['total_hit_rate']:.0%}, "
+            f"{s['entries']} entries, {s['bytes'] / 1024 ** 2:.1f} MB"
+        ]
+        if hasattr(self.embeddings, "report"):
+            lines.append(self.embeddings.report())
+        return "\n".join(lines)
@@ -0,0 +1,143 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+import tiktoken
+from langchain_core.embeddings import Embeddings
+
+# errors worth waiting out, anything else (bad key, bad request...) fails right away
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+class TokenBudget:
+    """
+    Token bucket that refills at tokens_per_minute.
+    acquire() blocks until the tokens can be spent, so all batches together stay under the quota.
+    """
+
+    def __init__(self, tokens_per_minute):
+        self.capacity = tokens_per_minute
+        self.available = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens):
+        # a batch bigger than the whole bucket just waits for a full bucket
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.available >= tokens:
+                    self.available -= tokens
+                    return
+                wait = (tokens - self.available) / self.rate
+            time.sleep(wait)
+
+
+class EmbeddingScheduler(Embeddings):
+    """
+    Wraps an embeddings client and sends document batches concurrently,
+    staying under a tokens-per-minute budget and retrying rate limits with backoff.
+    The wrapped client should have its own retries turned off (max_retries=0).
+
+    To try it without spending quota, start chat/utils/fake_embeddings_server.py and point
+    OPENAI_BASE_URL at it.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        batch_size=256,
+        max_concurrency=4,
+        tokens_per_minute=1_000_000,
+        max_retries=6,
+        base_delay=1.0,
+        max_delay=60.0,
+    ):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.budget = TokenBudget(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.encoding = tiktoken.get_encoding("cl100k_base")
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {"batches": 0, "texts": 0, "tokens": 0, "retries": 0, "rate_limited": 0, "seconds": 0.0}
+
+    def _retry_delay(self, error, attempt):
+        # use the server's retry-after when it sends one, otherwise exponential backoff with jitter
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_delay)
+            except ValueError:
+                pass
+        delay = min(self.base_delay * (2 ** attempt), self.max_delay)
+        return delay * (0.5 + random.random() / 2)
+
+    def _with_retries(self, call, *args):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return call(*args)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                with self.stats_lock:
+                    self.stats["retries"] += 1
+                    if isinstance(e, openai.RateLimitError):
+                        self.stats["rate_limited"] += 1
+                time.sleep(self._retry_delay(e, attempt))
+
+    def _embed_batch(self, batch):
+        tokens = sum(len(self.encoding.encode(text, disallowed_special=())) for text in batch)
+        self.budget.acquire(tokens)
+        vectors = self._with_retries(self.embeddings.embed_documents, batch)
+        with self.stats_lock:
+            self.stats["batches"] += 1
+            self.stats["texts"] += len(batch)
+            self.stats["tokens"] += tokens
+        return vectors
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            # map keeps the batches in order
+            results = list(pool.map(self._embed_batch, batches))
+        with self.stats_lock:
+            self.stats["seconds"] += time.monotonic() - started
+
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+    def embed_query(self, text):
+        return self._with_retries(self.embeddings.embed_query, text)
+
+    def report(self):
+        """One line summary of how the embedding went"""
+        s = self.stats
+        seconds = s["seconds"] or 1e-9
+        return (
+            f"Embedded {s['texts']} chunks ({s['tokens']} tokens) in {s['batches']} batches "
+            f"over {s['seconds']:.1f}s: {s['texts'] / seconds:.1f} chunks/s, "
+            f"{s['tokens'] / seconds * 60:.0f} tokens/min, {s['retries']} retries "
+            f"({s['rate_limited']} rate limited)"
+        )
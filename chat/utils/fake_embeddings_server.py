@@ -0,0 +1,108 @@
+"""
+Tiny stand-in for the OpenAI embeddings endpoint, for trying out index builds locally.
+
+    python -m chat.utils.fake_embeddings_server --port 8765 --rate-limit-every 5
+    OPENAI_BASE_URL=http://localhost:8765/v1 OPENAI_API_KEY=fake python -m chat.utils.build_index
+
+Vectors are derived from a hash of the input, so the same text always gets the same vector.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+def fake_vector(item, dimensions):
+    # item is either a string or a list of token ids, depending on the client
+    seed = hashlib.sha256(json.dumps(item).encode("utf-8")).digest()
+    rng = np.random.default_rng(int.from_bytes(seed[:8], "little"))
+    vector = rng.standard_normal(dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class FakeEmbeddingsHandler(BaseHTTPRequestHandler):
+    dimensions = 3072
+    latency = 0.05
+    rate_limit_every = 0
+    request_count = 0
+    count_lock = threading.Lock()
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/embeddings"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        with FakeEmbeddingsHandler.count_lock:
+            FakeEmbeddingsHandler.request_count += 1
+            count = FakeEmbeddingsHandler.request_count
+
+        if self.rate_limit_every and count % self.rate_limit_every == 0:
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                headers={"retry-after": "0.5"},
+            )
+            return
+
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        inputs = request["input"]
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        dimensions = request.get("dimensions") or self.dimensions
+
+        time.sleep(self.latency)
+        data = []
+        for i, item in enumerate(inputs):
+            vector = fake_vector(item, dimensions)
+            if request.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+
+        prompt_tokens = sum(len(item) if isinstance(item, list) else len(item.split()) for item in inputs)
+        self._send_json(200, {
+            "object": "list",
+            "data": data,
+            "model": request.get("model", "fake"),
+            "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI embeddings server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dimensions", type=int, default=3072)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds to wait per request")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="answer every Nth request with a 429")
+    args = parser.parse_args()
+
+    FakeEmbeddingsHandler.dimensions = args.dimensions
+    FakeEmbeddingsHandler.latency = args.latency
+    FakeEmbeddingsHandler.rate_limit_every = args.rate_limit_every
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), FakeEmbeddingsHandler)
+    print(f"Fake embeddings server on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
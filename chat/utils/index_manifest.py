@@ -0,0 +1,63 @@
+import hashlib
+import json
+from pathlib import Path
+
+MANIFEST_NAME = "manifest.json"
+
+
+def hash_file(path, block_size=1 << 20):
+    """Returns the sha256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_ids_for(rel_path, file_hash, count):
+    # ids only change when the pdf does, the path part keeps copies of the same pdf apart
+    path_hash = hashlib.sha256(rel_path.encode("utf-8")).hexdigest()[:8]
+    return [f"{path_hash}-{file_hash[:16]}-{i}" for i in range(count)]
+
+
+def empty_manifest(embedding_model):
+    return {"embedding_model": embedding_model, "files": {}}
+
+
+def load_manifest(index_path):
+    """Loads the manifest stored with the index, or None if there isn't one"""
+    manifest_path = Path(index_path) / MANIFEST_NAME
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(index_path, manifest):
+    manifest_path = Path(index_path) / MANIFEST_NAME
+    tmp_path = manifest_path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    tmp_path.replace(manifest_path)
+
+
+def diff_manifest(manifest, current_hashes):
+    """
+    Compares the files recorded in the manifest with what is on disk right now.
+    current_hashes maps relative pdf path -> content hash.
+    Returns (added_or_changed, deleted) lists of relative paths.
+    """
+    known = manifest["files"]
+    changed = [
+        rel_path for rel_path, file_hash in current_hashes.items()
+        if rel_path not in known or known[rel_path]["hash"] != file_hash
+    ]
+    deleted = [rel_path for rel_path in known if rel_path not in current_hashes]
+    return changed, deleted
+
+
+def refresh_vector_ids(manifest, db):
+    """Records where each chunk currently sits in the faiss index (positions shift after deletes)"""
+    positions = {doc_id: pos for pos, doc_id in db.index_to_docstore_id.items()}
+    for entry in manifest["files"].values():
+        entry["vector_ids"] = [positions[chunk_id] for chunk_id in entry["chunk_ids"]]
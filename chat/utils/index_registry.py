@@ -0,0 +1,119 @@
+import threading
+import time
+from pathlib import Path
+
+from langchain_core.retrievers import BaseRetriever
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+
+class _IndexChangeHandler(FileSystemEventHandler):
+    def __init__(self, registry):
+        self.registry = registry
+
+    def on_any_event(self, event):
+        if event.event_type not in ("created", "modified", "moved", "deleted"):
+            return
+        trigger_names = self.registry.trigger_names
+        if trigger_names is not None:
+            # a moved event's destination is where an atomic replace lands
+            names = {Path(event.src_path).name, Path(getattr(event, "dest_path", "") or event.src_path).name}
+            if not names & set(trigger_names):
+                return
+        self.registry.schedule_reload()
+
+
+class IndexRegistry:
+    """
+    Holds one loaded index per process, shared by every session.
+    When files under index_path change, the index is reloaded in the background
+    and swapped in once it loaded fine; searches keep using the old one until then.
+    Pass trigger_names to only react to changes of those files (e.g. the version pointer).
+    A loader returning None counts as a failed load: the previous index stays, and get()
+    doesn't retry on every call, the next file event does.
+    """
+
+    def __init__(self, index_path, loader, debounce=2.0, trigger_names=None):
+        self.index_path = Path(index_path)
+        self.loader = loader
+        self.debounce = debounce
+        self.trigger_names = trigger_names
+        self.store = None
+        self.attempted = False
+        self.version = 0
+        self.loaded_at = None
+        self.lock = threading.Lock()
+        self.timer = None
+        self.observer = None
+
+    def get(self):
+        """Returns the current index, loading it on first use"""
+        if not self.attempted:
+            with self.lock:
+                if not self.attempted:
+                    self.attempted = True
+                    store = self.loader()
+                    if store is not None:
+                        self._swap(store)
+        return self.store
+
+    def _swap(self, store):
+        self.store = store
+        self.version += 1
+        self.loaded_at = time.time()
+
+    def reload(self):
+        try:
+            store = self.loader()
+        except Exception as e:
+            # probably caught a build half way, the next file event will try again
+            print(f"Keeping the current index, reload failed: {str(e)}")
+            return False
+        if store is None:
+            print(f"Keeping the current index, nothing loaded from {self.index_path}")
+            return False
+        with self.lock:
+            self._swap(store)
+        print(f"Reloaded index from {self.index_path} (version {self.version})")
+        return True
+
+    def schedule_reload(self):
+        # a build touches lots of files, wait until it has been quiet for a bit
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.debounce, self.reload)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def start_watching(self):
+        if self.observer is not None:
+            return
+        self.index_path.mkdir(parents=True, exist_ok=True)
+        self.observer = Observer()
+        self.observer.daemon = True
+        self.observer.schedule(_IndexChangeHandler(self), str(self.index_path), recursive=True)
+        self.observer.start()
+
+    def stop_watching(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer = None
+
+    def as_retriever(self, **search_kwargs):
+        return LiveIndexRetriever(registry=self, search_kwargs=search_kwargs)
+
+
+class LiveIndexRetriever(BaseRetriever):
+    """Retriever that always searches whatever index the registry holds right now"""
+
+    registry: IndexRegistry
+    search_kwargs: dict = {}
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        store = self.registry.get()
+        if store is None:
+            return []
+        return store.similarity_search(query, **self.search_kwargs)
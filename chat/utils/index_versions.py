@@ -0,0 +1,155 @@
+import argparse
+import json
+import os
+import secrets
+import shutil
+import time
+from pathlib import Path
+
+from .index_manifest import hash_file
+
+VERSIONS_DIR_NAME = "versions"
+POINTER_NAME = "CURRENT"
+VERSION_INFO_NAME = "version.json"
+
+
+def versions_dir(index_path):
+    return Path(index_path) / VERSIONS_DIR_NAME
+
+
+def list_versions(index_path):
+    """Published versions, oldest first (names start with a timestamp)"""
+    path = versions_dir(index_path)
+    if not path.exists():
+        return []
+    return sorted(
+        p.name for p in path.iterdir()
+        if p.is_dir() and not p.name.startswith(".") and (p / VERSION_INFO_NAME).exists()
+    )
+
+
+def current_version(index_path):
+    pointer = Path(index_path) / POINTER_NAME
+    if not pointer.exists():
+        return None
+    return pointer.read_text(encoding="utf-8").strip() or None
+
+
+def current_version_path(index_path):
+    """Directory of the version the apps should read, or None if nothing was published yet"""
+    version = current_version(index_path)
+    if version is None:
+        return None
+    return versions_dir(index_path) / version
+
+
+def start_version(index_path):
+    """Makes a hidden staging directory for a new build to write into"""
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(3)}"
+    staging = versions_dir(index_path) / f".staging-{name}"
+    staging.mkdir(parents=True)
+    return name, staging
+
+
+def write_version_info(version_path, name, extra=None):
+    version_path = Path(version_path)
+    files = {
+        p.relative_to(version_path).as_posix(): hash_file(p)
+        for p in sorted(version_path.rglob("*"))
+        if p.is_file() and p.name != VERSION_INFO_NAME
+    }
+    info = {"version": name, "created_at": time.time(), "files": files, **(extra or {})}
+    with open(version_path / VERSION_INFO_NAME, "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2, sort_keys=True)
+
+
+def verify_version(version_path):
+    """Checks every file of a version against its recorded sha256, returns a list of problems"""
+    version_path = Path(version_path)
+    info_path = version_path / VERSION_INFO_NAME
+    if not info_path.exists():
+        return [f"{version_path.name} has no {VERSION_INFO_NAME}, it was never finished"]
+    with open(info_path, "r", encoding="utf-8") as f:
+        info = json.load(f)
+    problems = []
+    for rel_path, expected in info["files"].items():
+        file_path = version_path / rel_path
+        if not file_path.exists():
+            problems.append(f"missing {rel_path}")
+        elif hash_file(file_path) != expected:
+            problems.append(f"checksum mismatch for {rel_path}")
+    return problems
+
+
+def point_to(index_path, name):
+    # readers either see the old pointer or the new one, never half a file
+    pointer = Path(index_path) / POINTER_NAME
+    tmp_pointer = pointer.with_name(POINTER_NAME + ".tmp")
+    with open(tmp_pointer, "w", encoding="utf-8") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_pointer, pointer)
+
+
+def prune_versions(index_path, keep):
+    """Deletes all but the newest `keep` versions, never the current one"""
+    current = current_version(index_path)
+    versions = list_versions(index_path)
+    for name in versions[:max(0, len(versions) - keep)]:
+        if name != current:
+            shutil.rmtree(versions_dir(index_path) / name)
+    # leftovers from builds that crashed before publishing
+    for staging in versions_dir(index_path).glob(".staging-*"):
+        if time.time() - staging.stat().st_mtime > 24 * 3600:
+            shutil.rmtree(staging, ignore_errors=True)
+
+
+def publish_version(index_path, name, staging, keep=3, extra=None):
+    """Checksums a finished build, moves it into place and flips the pointer to it"""
+    # the checksums were just taken from these files, hashing them again would only double the reads;
+    # rollback and --verify check them against the disk later
+    write_version_info(staging, name, extra)
+    final_path = versions_dir(index_path) / name
+    staging.rename(final_path)
+    point_to(index_path, name)
+    prune_versions(index_path, keep)
+    return final_path
+
+
+def rollback(index_path, version=None):
+    """Points the apps back at `version`, or at the one published before the current one"""
+    versions = list_versions(index_path)
+    current = current_version(index_path)
+    if version is None:
+        older = [name for name in versions if current is None or name < current]
+        if not older:
+            raise ValueError("There is no older version to roll back to")
+        version = older[-1]
+    if version not in versions:
+        raise ValueError(f"Unknown index version: {version}")
+    problems = verify_version(versions_dir(index_path) / version)
+    if problems:
+        raise ValueError(f"Version {version} is damaged: {', '.join(problems)}")
+    point_to(index_path, version)
+    return version
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List, verify or roll back published index versions")
+    parser.add_argument("--index", default=str(Path(__file__).parent.parent.parent / "faiss_index"))
+    parser.add_argument("--rollback", nargs="?", const="", default=None, metavar="VERSION",
+                        help="switch to VERSION, or to the previous version if none is given")
+    parser.add_argument("--verify", action="store_true", help="check the checksums of every version")
+    args = parser.parse_args()
+
+    if args.rollback is not None:
+        print(f"Now serving {rollback(args.index, args.rollback or None)}")
+    current = current_version(args.index)
+    for name in list_versions(args.index):
+        marker = "*" if name == current else " "
+        status = ""
+        if args.verify:
+            problems = verify_version(versions_dir(args.index) / name)
+            status = " ok" if not problems else " " + "; ".join(problems)
+        print(f"{marker} {name}{status}")
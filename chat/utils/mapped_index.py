@@ -0,0 +1,496 @@
+import json
+import mmap
+import zlib
+from pathlib import Path
+
+import faiss
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_core.vectorstores import VectorStore
+
+MAPPED_DIR_NAME = "mapped"
+INFO_NAME = "mapped.json"
+METADATA_INDEX_NAME = "metadata_index.json"
+# metadata we keep precomputed position lists for, "lecture" is the pdf's file name
+INDEXED_FIELDS = ("subject", "source", "lecture", "page")
+
+ANN_NAME = "ann.faiss"
+# sq8 / pq storage: a faiss IndexScalarQuantizer / IndexPQ holding the codes
+CODES_NAME = "codes.faiss"
+ANN_TYPES = ("flat", "ivf", "hnsw", "pq", "ivfpq")
+DEFAULT_ANN_PARAMS = {
+    "nlist": 1024,          # ivf: number of clusters
+    "nprobe": 16,           # ivf: clusters searched per query
+    "hnsw_m": 32,           # hnsw: links per node
+    "ef_construction": 200, # hnsw: search width while building
+    "ef_search": 64,        # hnsw: search width per query
+    "pq_m": 64,             # pq: sub-quantizers, has to divide the dimensions
+    "pq_bits": 8,           # pq: bits per sub-quantizer code
+}
+
+# how the vectors themselves are stored: as is, one byte per dimension, or pq codes
+STORAGE_TYPES = ("float32", "sq8", "pq")
+
+
+def project_vectors(vectors, dimensions):
+    """
+    Keeps the first `dimensions` components and re-normalizes. text-embedding-3 vectors
+    are trained so that a shortened vector still works, it's what the api's dimensions option does.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not dimensions or dimensions >= vectors.shape[-1]:
+        return vectors
+    shortened = vectors[..., :dimensions]
+    norms = np.linalg.norm(shortened, axis=-1, keepdims=True)
+    return np.ascontiguousarray(shortened / np.maximum(norms, 1e-12))
+
+
+def clamp_pq_params(params, count, dimensions):
+    requested = params
+    params = dict(params)
+    # pq_m has to divide the dimensions, take the closest one below that does
+    params["pq_m"] = max(m for m in range(1, min(params["pq_m"], dimensions) + 1) if dimensions % m == 0)
+    # faiss wants ~39 training points per code, small corpora get fewer bits
+    while params["pq_bits"] > 1 and 39 * 2 ** params["pq_bits"] > count:
+        params["pq_bits"] -= 1
+    if (params["pq_m"], params["pq_bits"]) != (requested["pq_m"], requested["pq_bits"]):
+        print(f"Note: PQ{requested['pq_m']}x{requested['pq_bits']} doesn't fit {count} vectors x {dimensions} dims, "
+              f"using PQ{params['pq_m']}x{params['pq_bits']}")
+    return params
+
+
+def write_vectors(path, vectors, storage, params):
+    """
+    Stores the vectors in the given format and returns what they decode to, so the
+    norms can be computed from exactly that.
+    sq8 and pq go into a faiss index of just the codes, searches compute distances on
+    the codes directly (asymmetric, the query stays float32) instead of decoding them.
+    """
+    if storage == "float32":
+        np.save(path / "vectors.npy", vectors)
+        return vectors, {}
+    if storage == "sq8":
+        index = faiss.IndexScalarQuantizer(vectors.shape[1], faiss.ScalarQuantizer.QT_8bit)
+        used = {}
+    elif storage == "pq":
+        used = clamp_pq_params({**DEFAULT_ANN_PARAMS, **params}, len(vectors), vectors.shape[1])
+        index = faiss.IndexPQ(vectors.shape[1], used["pq_m"], used["pq_bits"])
+        used = {"pq_m": used["pq_m"], "pq_bits": used["pq_bits"]}
+    else:
+        raise ValueError(f"Unknown storage {storage}, pick one of {', '.join(STORAGE_TYPES)}")
+    if len(vectors):
+        index.train(vectors)
+        index.add(vectors)
+    faiss.write_index(index, str(path / CODES_NAME))
+    decoded = index.reconstruct_n(0, len(vectors)) if len(vectors) else vectors
+    return decoded, used
+
+
+def indexed_values(metadata):
+    values = {field: metadata.get(field) for field in ("subject", "source", "page")}
+    if metadata.get("source"):
+        values["lecture"] = Path(metadata["source"]).name
+    return {field: str(value) for field, value in values.items() if value is not None}
+
+
+def write_metadata_index(path, docs):
+    """
+    Groups chunk positions by subject / source / lecture / page.
+    metadata_ids.npy holds all the groups back to back, metadata_index.json says
+    where each (field, value) group starts and how long it is.
+    """
+    groups = {field: {} for field in INDEXED_FIELDS}
+    for position, doc in enumerate(docs):
+        for field, value in indexed_values(doc.metadata).items():
+            groups[field].setdefault(value, []).append(position)
+
+    spans = {field: {} for field in INDEXED_FIELDS}
+    all_ids = []
+    for field in INDEXED_FIELDS:
+        for value, positions in groups[field].items():
+            spans[field][value] = [len(all_ids), len(positions)]
+            all_ids.extend(positions)
+    np.save(path / "metadata_ids.npy", np.asarray(all_ids, dtype=np.int64))
+    with open(path / METADATA_INDEX_NAME, "w", encoding="utf-8") as f:
+        json.dump(spans, f, ensure_ascii=False)
+
+
+def write_mapped_index(path, ids, vectors, docs, embedding_model, project_dims=None, storage="float32",
+                       storage_params=None):
+    """
+    Writes an index the chat app can open without loading it into memory:
+      vectors.npy  float32 (n, dim), memory-mapped at load time
+                   (or codes.faiss with sq8 / pq storage)
+      norms.npy    squared length of every vector, so searches don't recompute them
+      docs.bin     one zlib compressed json record per chunk (id, text, metadata)
+      offsets.npy  where each record starts in docs.bin (n + 1 entries)
+      metadata_index.json + metadata_ids.npy  chunk positions per subject / lecture / page
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    vectors = project_vectors(np.ascontiguousarray(vectors, dtype=np.float32), project_dims)
+    requested_params = dict(storage_params or {}) if storage == "pq" else {}
+
+    decoded, used_params = write_vectors(path, vectors, storage, requested_params)
+    np.save(path / "norms.npy", np.einsum("ij,ij->i", decoded, decoded).astype(np.float32))
+
+    offsets = [0]
+    with open(path / "docs.bin", "wb") as f:
+        for doc_id, doc in zip(ids, docs):
+            record = {"id": doc_id, "page_content": doc.page_content, "metadata": doc.metadata}
+            blob = zlib.compress(json.dumps(record, ensure_ascii=False).encode("utf-8"))
+            f.write(blob)
+            offsets.append(offsets[-1] + len(blob))
+    np.save(path / "offsets.npy", np.asarray(offsets, dtype=np.uint64))
+    write_metadata_index(path, docs)
+
+    info = {
+        "embedding_model": embedding_model,
+        "count": int(vectors.shape[0]),
+        "dimensions": int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+        "distance": "l2",
+        "project_dims": project_dims or None,
+        "storage": {"type": storage, "params": used_params, "requested": requested_params},
+    }
+    with open(path / INFO_NAME, "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+
+
+def ann_factory_string(index_type, params, count, dimensions):
+    """
+    Faiss factory string for an index type. Cluster and code counts get scaled down
+    when there are too few vectors to train them. Returns (factory, params actually used).
+    """
+    params = dict(params)
+    if index_type in ("ivf", "ivfpq"):
+        # faiss wants ~39 training points per cluster
+        nlist = max(1, min(params["nlist"], count // 39))
+        if nlist != params["nlist"]:
+            print(f"Note: {params['nlist']} clusters don't fit {count} vectors, using {nlist}")
+        params["nlist"] = nlist
+        params["nprobe"] = min(params["nprobe"], params["nlist"])
+    if index_type in ("pq", "ivfpq"):
+        params = clamp_pq_params(params, count, dimensions)
+
+    factories = {
+        "ivf": f"IVF{params.get('nlist')},Flat",
+        "hnsw": f"HNSW{params['hnsw_m']}",
+        "pq": f"PQ{params['pq_m']}x{params['pq_bits']}",
+        "ivfpq": f"IVF{params.get('nlist')},PQ{params['pq_m']}x{params['pq_bits']}",
+    }
+    return factories[index_type], params
+
+
+def build_ann_index(path, index_type="flat", **params):
+    """
+    Adds an approximate index (ann.faiss) next to the vectors of a mapped index.
+    "flat" removes it again, searches then scan the vectors exactly.
+    """
+    if index_type not in ANN_TYPES:
+        raise ValueError(f"Unknown index type {index_type}, pick one of {', '.join(ANN_TYPES)}")
+    path = Path(path)
+    with open(path / INFO_NAME, "r", encoding="utf-8") as f:
+        info = json.load(f)
+    ann_path = path / ANN_NAME
+    # drop the old ann index on disk first, the store we train from below reads mapped.json
+    info.pop("ann", None)
+    with open(path / INFO_NAME, "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+    if ann_path.exists():
+        ann_path.unlink()
+
+    if index_type != "flat" and info["count"]:
+        store = MappedVectorStore(path, None)
+        requested = {**DEFAULT_ANN_PARAMS, **params}
+        factory, used = ann_factory_string(index_type, requested, info["count"], info["dimensions"])
+        index = faiss.index_factory(info["dimensions"], factory)
+        if index_type == "hnsw":
+            index.hnsw.efConstruction = used["ef_construction"]
+        if not index.is_trained:
+            index.train(store.rows(0, len(store)))
+        # add in slices so a big corpus doesn't need a second full copy in memory
+        for start in range(0, info["count"], 65536):
+            index.add(store.rows(start, min(start + 65536, info["count"])))
+        faiss.write_index(index, str(ann_path))
+        info["ann"] = {"type": index_type, "factory": factory, "params": used, "requested": requested}
+
+    with open(path / INFO_NAME, "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+
+
+def index_settings(path):
+    """What a mapped index was built with, to tell whether a build with other options needs a new one"""
+    with open(Path(path) / INFO_NAME, "r", encoding="utf-8") as f:
+        info = json.load(f)
+    ann = info.get("ann")
+    storage = info.get("storage") or {"type": "float32", "requested": {}}
+    if storage["type"] != "float32" and not (Path(path) / CODES_NAME).exists():
+        # quantized with the old numpy codes layout, has to be rebuilt
+        storage = {"type": None, "requested": {}}
+    return {
+        "index_type": ann["type"] if ann else "flat",
+        "index_params": ann["requested"] if ann else {},
+        "project_dims": info.get("project_dims"),
+        "storage": storage["type"],
+        "storage_params": storage["requested"],
+    }
+
+
+def export_faiss_db(db, path, embedding_model, project_dims=None, storage="float32", storage_params=None):
+    """Writes a LangChain FAISS db out in the mapped format, in faiss index order"""
+    count = db.index.ntotal
+    vectors = db.index.reconstruct_n(0, count) if count else np.zeros((0, db.index.d), dtype=np.float32)
+    ids = [db.index_to_docstore_id[i] for i in range(count)]
+    docs = [db.docstore.search(doc_id) for doc_id in ids]
+    write_mapped_index(path, ids, vectors, docs, embedding_model, project_dims, storage, storage_params)
+
+
+class MappedVectorStore(VectorStore):
+    """
+    Read-only vector store over an index written by write_mapped_index.
+    Vectors are memory-mapped (so every process shares the same OS pages) and chunk
+    text is only read and decompressed for the hits a search returns.
+    Filters on subject / source / lecture / page narrow the rows before the vector
+    search, so a filtered query only costs as much as the rows it can match.
+    If the index was built with an ann.faiss, big searches go through that instead;
+    filtered sets smaller than exact_threshold are still scanned exactly.
+    Quantized vectors (sq8 / pq) are searched on their codes by faiss without decoding them,
+    and query vectors are shortened to match vectors stored shortened.
+    children is an optional MappedVectorStore of small chunks cut from these ones (see parent_child).
+    """
+
+    exact_threshold = 20000
+
+    def __init__(self, path, embeddings, children=None):
+        self.path = Path(path)
+        self.embedding_function = embeddings
+        self.children = children
+        with open(self.path / INFO_NAME, "r", encoding="utf-8") as f:
+            self.info = json.load(f)
+        self.storage = (self.info.get("storage") or {"type": "float32"})["type"]
+        self.code_index = None
+        if self.storage == "float32":
+            self.stored = np.load(self.path / "vectors.npy", mmap_mode="r")
+        else:
+            # codes are a fraction of the float32 size, so they live in memory inside faiss;
+            # stored is a numpy view of them (no copy), rows() decodes them
+            self.code_index = faiss.read_index(str(self.path / CODES_NAME))
+            size = self.code_index.ntotal * self.code_index.code_size
+            codes = faiss.rev_swig_ptr(self.code_index.codes.data(), size) if size else np.zeros(0, np.uint8)
+            self.stored = codes.reshape(self.code_index.ntotal, self.code_index.code_size)
+        self.norms = np.load(self.path / "norms.npy", mmap_mode="r")
+        self.offsets = np.load(self.path / "offsets.npy", mmap_mode="r")
+        with open(self.path / "docs.bin", "rb") as f:
+            # mmap can't map an empty file
+            self.docs = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b""
+        with open(self.path / METADATA_INDEX_NAME, "r", encoding="utf-8") as f:
+            self.metadata_index = json.load(f)
+        self.metadata_ids = np.load(self.path / "metadata_ids.npy", mmap_mode="r")
+        self.ann = None
+        if self.info.get("ann"):
+            try:
+                # ivf lists and hnsw graphs can be mapped too, so processes share them
+                self.ann = faiss.read_index(str(self.path / ANN_NAME), faiss.IO_FLAG_MMAP)
+            except RuntimeError:
+                self.ann = faiss.read_index(str(self.path / ANN_NAME))
+
+    @classmethod
+    def exists(cls, path):
+        return (Path(path) / INFO_NAME).exists()
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    def __len__(self):
+        return int(self.stored.shape[0])
+
+    def _decode(self, rows):
+        if self.code_index is not None:
+            if not len(rows):
+                return np.zeros((0, self.info["dimensions"]), dtype=np.float32)
+            return self.code_index.sa_decode(np.ascontiguousarray(rows))
+        return np.asarray(rows, dtype=np.float32)
+
+    def rows(self, start, stop):
+        """Vectors [start, stop) as float32, decoded if they're stored quantized"""
+        return np.ascontiguousarray(self._decode(self.stored[start:stop]), dtype=np.float32)
+
+    def rows_at(self, positions):
+        return np.ascontiguousarray(self._decode(self.stored[positions]), dtype=np.float32)
+
+    def prepare_query(self, embedding):
+        # queries come at the embedding model's full size, the index may store fewer dimensions
+        query = np.asarray(embedding, dtype=np.float32)
+        if query.shape[-1] != self.info["dimensions"]:
+            query = project_vectors(query, self.info["dimensions"])
+        return query
+
+    def get_record(self, position):
+        start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+        return json.loads(zlib.decompress(self.docs[start:end]))
+
+    def get_document(self, position):
+        record = self.get_record(position)
+        return Document(id=record["id"], page_content=record["page_content"], metadata=record["metadata"])
+
+    def values(self, field):
+        """Distinct values of an indexed metadata field, e.g. values("lecture")"""
+        return sorted(self.metadata_index.get(field, {}))
+
+    def positions_for(self, field, value):
+        start, count = self.metadata_index[field].get(str(value), (0, 0))
+        return self.metadata_ids[start:start + count]
+
+    def _split_filter(self, filter):
+        """
+        Turns the indexed part of a filter into a sorted array of candidate positions.
+        Returns (positions or None if nothing was indexed, the rest of the filter).
+        """
+        positions = None
+        rest = {}
+        for key, value in filter.items():
+            if key not in self.metadata_index:
+                rest[key] = value
+                continue
+            wanted = value if isinstance(value, list) else [value]
+            matches = np.unique(np.concatenate([self.positions_for(key, v) for v in wanted] or [[]]))
+            positions = matches if positions is None else np.intersect1d(positions, matches)
+        if positions is not None:
+            positions = positions.astype(np.int64)
+        return positions, rest
+
+    def _nearest(self, query, k, positions=None):
+        """Positions and squared l2 distances of the k nearest rows (among positions if given), nearest first"""
+        if self.code_index is not None:
+            return self._code_search(query, k, positions)
+        distances = self._distances(query, positions)
+        count = min(k, len(distances))
+        top = np.argpartition(distances, count - 1)[:count]
+        top = top[np.argsort(distances[top])]
+        return (top if positions is None else positions[top]), distances[top]
+
+    def _code_search(self, query, k, positions=None):
+        # exhaustive, but the distances are computed on the codes by faiss, nothing gets decoded
+        query = np.ascontiguousarray(query, dtype=np.float32).reshape(1, -1)
+        k = min(k, len(self) if positions is None else len(positions))
+        if positions is None:
+            distances, labels = self.code_index.search(query, k)
+            found = labels[0]
+        elif self.storage == "sq8":
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(positions))
+            distances, labels = self.code_index.search(query, k, params=params)
+            found = labels[0]
+        else:
+            # IndexPQ takes no id selector, search a throwaway one holding only the allowed codes
+            subset = faiss.IndexPQ(self.code_index.d, self.code_index.pq.M, self.code_index.pq.nbits)
+            subset.pq = self.code_index.pq
+            subset.is_trained = True
+            subset.add_sa_codes(np.ascontiguousarray(self.stored[positions]))
+            distances, labels = subset.search(query, k)
+            found = np.where(labels[0] >= 0, positions[labels[0]], -1)
+        keep = found >= 0
+        return found[keep].astype(np.int64), np.maximum(distances[0][keep], 0)
+
+    def _distances(self, query, positions=None, block_size=65536):
+        # squared l2, same as faiss' flat index, computed in blocks so we never copy the whole matrix
+        query_norm = float(query @ query)
+        total = len(self) if positions is None else len(positions)
+        out = np.empty(total, dtype=np.float32)
+        for start in range(0, total, block_size):
+            stop = min(start + block_size, total)
+            if positions is None:
+                rows, norms = self.rows(start, stop), self.norms[start:stop]
+            else:
+                # only touches the pages of the rows the filter allows
+                rows, norms = self.rows_at(positions[start:stop]), self.norms[positions[start:stop]]
+            out[start:stop] = norms - 2 * (rows @ query) + query_norm
+        return np.maximum(out, 0)
+
+    def _matches(self, metadata, filter):
+        for key, value in filter.items():
+            if isinstance(value, list):
+                if metadata.get(key) not in value:
+                    return False
+            elif metadata.get(key) != value:
+                return False
+        return True
+
+    def _ann_search_params(self, positions=None, **overrides):
+        ann = self.info["ann"]
+        params = {**ann["params"], **{k: v for k, v in overrides.items() if v is not None}}
+        selector = faiss.IDSelectorBatch(positions) if positions is not None else None
+        if ann["type"] in ("ivf", "ivfpq"):
+            return faiss.SearchParametersIVF(sel=selector, nprobe=params["nprobe"])
+        if ann["type"] == "hnsw":
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=params["ef_search"])
+        return None
+
+    def _use_ann(self, positions, rest):
+        if self.ann is None or rest:
+            return False
+        if positions is None:
+            return True
+        # plain pq can't take an id selector, and small sets are cheaper to scan exactly
+        return self.info["ann"]["type"] != "pq" and len(positions) > self.exact_threshold
+
+    def _ann_search(self, embedding, k, positions=None, **overrides):
+        query = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        distances, labels = self.ann.search(query, k, params=self._ann_search_params(positions, **overrides))
+        return [
+            (self.get_document(int(label)), float(distance))
+            for distance, label in zip(distances[0], labels[0])
+            if label >= 0
+        ]
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        if not len(self):
+            return []
+        positions, rest = self._split_filter(filter) if filter else (None, {})
+        if positions is not None and not len(positions):
+            return []
+        embedding = self.prepare_query(embedding)
+        if self._use_ann(positions, rest) and not kwargs.get("exact"):
+            return self._ann_search(embedding, k, positions, nprobe=kwargs.get("nprobe"), ef_search=kwargs.get("ef_search"))
+        if not rest:
+            found, distances = self._nearest(embedding, k, positions)
+            return [(self.get_document(int(p)), float(d)) for p, d in zip(found, distances)]
+
+        # filters on fields we don't index: walk hits nearest first until k of them match
+        found, distances = self._nearest(embedding, len(self) if positions is None else len(positions), positions)
+        results = []
+        for position, distance in zip(found, distances):
+            doc = self.get_document(int(position))
+            if self._matches(doc.metadata, rest):
+                results.append((doc, float(distance)))
+                if len(results) == k:
+                    break
+        return results
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        embedding = self.embedding_function.embed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k, filter=filter, **kwargs)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter=filter, **kwargs)]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter=filter, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        return self._euclidean_relevance_score_fn
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("Mapped indexes are read-only, rebuild them with build_index instead")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, path=None, **kwargs):
+        if path is None:
+            raise ValueError("MappedVectorStore.from_texts needs a path to write the index to")
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(i) for i in range(len(texts))]
+        docs = [Document(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas)]
+        vectors = np.asarray(embedding.embed_documents(texts), dtype=np.float32)
+        write_mapped_index(path, ids, vectors, docs, kwargs.get("embedding_model", ""))
+        return cls(path, embedding)
@@ -0,0 +1,188 @@
+import os
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from .index_registry import IndexRegistry
+from .mapped_index import MappedVectorStore, write_mapped_index
+from .tokens import get_encoding
+
+CHILD_DIR_NAME = "children"
+# small chunks are what we search, the big ones they were cut from are what we answer with
+CHILD_CHUNK_SIZE = int(os.getenv("CHILD_CHUNK_SIZE", "1000"))
+CHILD_CHUNK_OVERLAP = int(os.getenv("CHILD_CHUNK_OVERLAP", "100"))
+# by default the spans of one prompt may use as many tokens as the k best chunks sent whole
+# (what a plain k-chunk search costs), CONTEXT_TOKEN_BUDGET caps that further if set
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0")) or None
+# context tokens are counted with the tokenizer of the model that answers
+CONTEXT_TOKEN_MODEL = "gpt-4o"
+
+
+def count_tokens(text):
+    return len(get_encoding(CONTEXT_TOKEN_MODEL).encode(text))
+
+
+def get_child_splitter():
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHILD_CHUNK_SIZE,
+        chunk_overlap=CHILD_CHUNK_OVERLAP,
+        length_function=len,
+        is_separator_regex=False,
+        add_start_index=True,
+    )
+
+
+def split_children(parents):
+    """
+    Cuts every chunk of a mapped index into child chunks.
+    Each child remembers its parent's position and the [start, end) span it covers in the parent text.
+    """
+    splitter = get_child_splitter()
+    ids = []
+    docs = []
+    for position in range(len(parents)):
+        record = parents.get_record(position)
+        for i, child in enumerate(splitter.create_documents([record["page_content"]])):
+            start = child.metadata["start_index"]
+            if start < 0:
+                # the splitter couldn't find the child in the parent, fall back to the whole parent
+                start, end = 0, len(record["page_content"])
+            else:
+                end = start + len(child.page_content)
+            metadata = {
+                **record["metadata"],
+                "parent_id": record["id"],
+                "parent": position,
+                "start": start,
+                "end": end,
+            }
+            ids.append(f"{record['id']}-c{i}")
+            docs.append(Document(page_content=child.page_content, metadata=metadata))
+    return ids, docs
+
+
+def build_child_index(parent_path, child_path, embeddings, embedding_model, project_dims=None,
+                      storage="float32", storage_params=None):
+    """
+    Writes a mapped index of the child chunks of the mapped index at parent_path.
+    Unchanged children come straight out of the embedding cache on rebuilds.
+    Returns the number of children.
+    """
+    parents = MappedVectorStore(parent_path, None)
+    ids, docs = split_children(parents)
+    if docs:
+        vectors = np.asarray(embeddings.embed_documents([doc.page_content for doc in docs]), dtype=np.float32)
+    else:
+        vectors = np.zeros((0, parents.info["dimensions"]), dtype=np.float32)
+    write_mapped_index(child_path, ids, vectors, docs, embedding_model, project_dims, storage, storage_params)
+    return len(docs)
+
+
+def whole_chunk_tokens(hits, parents, k=4):
+    """Tokens of the k best parents of the hits sent whole, what a plain k-chunk search would cost"""
+    best = []
+    for child, _ in hits:
+        if child.metadata["parent"] not in best:
+            best.append(child.metadata["parent"])
+            if len(best) == k:
+                break
+    return sum(count_tokens(parents.get_record(parent)["page_content"]) for parent in best)
+
+
+def assemble_context(hits, parents, token_budget=CONTEXT_TOKEN_BUDGET, window=200, k=4):
+    """
+    Turns child hits (best first) into one Document per parent holding only the matched spans,
+    each widened by `window` characters, until the token budget is used up.
+    The budget (counted with tiktoken) is what the k best parents would cost sent whole,
+    or token_budget if that's smaller, so the context never gets bigger than a plain search's.
+    Overlapping spans of the same parent are merged so no text is sent twice.
+    """
+    budget = whole_chunk_tokens(hits, parents, k)
+    if token_budget:
+        budget = min(budget, token_budget)
+    texts = {}
+    spans = {}
+    used = 0
+    for child, _ in hits:
+        meta = child.metadata
+        parent = meta["parent"]
+        if parent not in texts:
+            texts[parent] = parents.get_record(parent)["page_content"]
+        text = texts[parent]
+        # the window can run past the end of the parent
+        start, end = max(0, meta["start"] - window), min(meta["end"] + window, len(text))
+        current = spans.get(parent, [])
+        candidate = merge_spans(current + [(start, end)])
+        cost = spans_tokens(text, candidate) - spans_tokens(text, current)
+        if used + cost > budget:
+            if used:
+                break
+            # always send at least the best hit, cut down to the budget
+            encoding = get_encoding(CONTEXT_TOKEN_MODEL)
+            kept = encoding.decode(encoding.encode(text[start:end])[:budget])
+            candidate = [(start, start + len(kept))]
+            cost = spans_tokens(text, candidate)
+        spans[parent] = candidate
+        used += cost
+
+    docs = []
+    for parent, parent_spans in spans.items():
+        record = parents.get_record(parent)
+        text = record["page_content"]
+        content = "\n...\n".join(text[s:e] for s, e in parent_spans)
+        metadata = {**record["metadata"], "spans": [list(span) for span in parent_spans]}
+        docs.append(Document(id=record["id"], page_content=content, metadata=metadata))
+    return docs
+
+
+def spans_tokens(text, spans):
+    return sum(count_tokens(text[start:end]) for start, end in spans)
+
+
+def merge_spans(spans):
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def parent_child_search(store, embedding, filter=None, child_k=12, token_budget=CONTEXT_TOKEN_BUDGET,
+                        window=200, k=4):
+    """Searches store.children by vector and returns the assembled parent spans"""
+    hits = store.children.similarity_search_with_score_by_vector(embedding, child_k, filter=filter)
+    return assemble_context(hits, store, token_budget, window, k)
+
+
+class ParentChildRetriever(BaseRetriever):
+    """
+    Searches the small child chunks of whatever index the registry holds and
+    answers with the parent spans around them, using no more tokens than the
+    search_kwargs["k"] (default 4) best parents sent whole would (and at most token_budget).
+    Indexes built before child chunks existed are searched the old way.
+    """
+
+    registry: IndexRegistry
+    search_kwargs: dict = {}
+    child_k: int = 12
+    token_budget: int | None = CONTEXT_TOKEN_BUDGET
+    window: int = 200
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        store = self.registry.get()
+        if store is None:
+            return []
+        if getattr(store, "children", None) is None:
+            return store.similarity_search(query, **self.search_kwargs)
+        embedding = store.embeddings.embed_query(query)
+        return parent_child_search(
+            store, embedding, self.search_kwargs.get("filter"), self.child_k, self.token_budget, self.window,
+            self.search_kwargs.get("k", 4),
+        )
+
@@ -0,0 +1,115 @@
+import itertools
+import os
+import threading
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.retrievers import BaseRetriever
+
+from .document_loader import get_text_splitter, is_in_memory, iter_pdf_pages
+
+# uploads with at least this many pages get indexed in the background, batch by batch
+PROGRESSIVE_MIN_PAGES = int(os.getenv("PROGRESSIVE_MIN_PAGES", "40"))
+PROGRESSIVE_BATCH_PAGES = int(os.getenv("PROGRESSIVE_BATCH_PAGES", "20"))
+
+
+class ProgressiveIngestion:
+    """
+    Parses and embeds pages [start, stop) of a pdf (path, bytes or memoryview) in batches
+    on a background thread, so nothing of it runs on the streamlit script thread.
+    Every finished batch is searchable right away through as_retriever(), so the chat
+    works after the first batch instead of after the whole document.
+    on_done(db) gets called with the finished index (not when cancelled or failed).
+    source is the name in the chunk metadata, defaults to the pdf's path.
+    """
+
+    def __init__(self, pdf, embeddings, start=0, stop=None, batch_pages=PROGRESSIVE_BATCH_PAGES,
+                 on_done=None, source=None):
+        self.pdf = pdf
+        self.source = source or ("upload.pdf" if is_in_memory(pdf) else str(pdf))
+        self.embeddings = embeddings
+        self.start_page = start
+        self.stop_page = stop
+        self.batch_pages = batch_pages
+        self.on_done = on_done
+        self.total_pages = (stop - start) if stop is not None else None
+        self.pages_done = 0
+        self.db = None
+        self.error = None
+        self.done = False
+        self.cancelled = False
+        self.lock = threading.Lock()
+        # set once the first batch is searchable (or we gave up)
+        self.first_batch = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        self.cancelled = True
+
+    @property
+    def finished(self):
+        return self.done or self.error is not None or self.cancelled
+
+    def _run(self):
+        try:
+            pages = iter_pdf_pages(self.pdf, self.start_page, self.stop_page, source=self.source)
+            splitter = get_text_splitter()
+            while not self.cancelled:
+                batch = list(itertools.islice(pages, self.batch_pages))
+                if not batch:
+                    break
+                for doc in batch:
+                    doc.metadata["source"] = self.source
+                    doc.metadata["document_type"] = "content"
+                chunks = splitter.split_documents(batch)
+                if chunks:
+                    self._add(chunks)
+                self.pages_done += len(batch)
+                self.first_batch.set()
+            self.done = not self.cancelled
+            if self.done and self.db is not None and self.on_done is not None:
+                self.on_done(self.db)
+        except Exception as e:
+            self.error = e
+            print(f"Indexing {self.source} failed: {str(e)}")
+        finally:
+            self.first_batch.set()
+
+    def _add(self, chunks):
+        # embed outside the lock so searches don't wait on the api
+        texts = [chunk.page_content for chunk in chunks]
+        vectors = self.embeddings.embed_documents(texts)
+        metadatas = [chunk.metadata for chunk in chunks]
+        with self.lock:
+            if self.db is None:
+                self.db = FAISS.from_embeddings(list(zip(texts, vectors)), self.embeddings, metadatas=metadatas)
+            else:
+                self.db.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas)
+
+    def search(self, query, k=4):
+        embedding = self.embeddings.embed_query(query)
+        with self.lock:
+            if self.db is None:
+                return []
+            return self.db.similarity_search_by_vector(embedding, k)
+
+    def as_retriever(self, k=4):
+        return ProgressiveRetriever(ingestion=self, k=k)
+
+
+class ProgressiveRetriever(BaseRetriever):
+    """Searches whatever part of the pdf is indexed so far"""
+
+    ingestion: ProgressiveIngestion
+    k: int = 4
+    # a question asked straight after uploading waits this long for the first batch
+    first_batch_timeout: float = 120.0
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        self.ingestion.first_batch.wait(self.first_batch_timeout)
+        return self.ingestion.search(query, self.k)
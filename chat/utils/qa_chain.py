@@ -1,15 +1,173 @@
 from langchain.prompts import PromptTemplate
-from langchain.memory import ConversationBufferMemory
+from langchain.memory import ConversationBufferMemory, ConversationSummaryBufferMemory
 from langchain.chains import ConversationalRetrievalChain, ConversationChain
+from langchain.chains.conversational_retrieval.base import _get_chat_history
 from langchain_openai.chat_models import ChatOpenAI
+from langchain_core.callbacks import BaseCallbackHandler, CallbackManagerForChainRun
 from dotenv import load_dotenv
+import os
+import re
+
+from .tokens import get_encoding
 
 
 load_dotenv()
 
-def create_qa_chain(retriever):
+# marks the llm call that writes the answer, so only its tokens get streamed to the student
+ANSWER_TAG = "answer"
+
+class AnswerStreamHandler(BaseCallbackHandler):
+    """
+    Callback that hands the answer so far to show() every time a new token arrives.
+    Pass it in the invoke config: chain.invoke(inputs, config={"callbacks": [handler]})
+    Other llm calls of the chain (like rephrasing the question) are ignored.
+    """
+
+    def __init__(self, show):
+        # not called on_text, callback handlers already have an on_text hook
+        self.show = show
+        self.text = ""
+        self.answer_runs = set()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, **kwargs):
+        if tags and ANSWER_TAG in tags:
+            self.answer_runs.add(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, tags=None, **kwargs):
+        if tags and ANSWER_TAG in tags:
+            self.answer_runs.add(run_id)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if run_id in self.answer_runs:
+            self.text += token
+            self.show(self.text)
+
+# how much chat history goes into every prompt with memory_mode="rolling"
+MEMORY_TOKEN_LIMIT = int(os.getenv("MEMORY_TOKEN_LIMIT", "1500"))
+MEMORY_MAX_TURNS = int(os.getenv("MEMORY_MAX_TURNS", "6"))
+
+SUMMARY_PROMPT = PromptTemplate(
+    input_variables=["summary", "new_lines"],
+    template="""Progressively summarize this study session between a student and a teaching assistant, \
+adding the new lines to the current summary. Keep the topics covered, what the student struggled with \
+and anything they asked to remember. Keep the whole summary under 150 words.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{new_lines}
+
+New summary:""",
+)
+
+class RollingSummaryMemory(ConversationSummaryBufferMemory):
+    """
+    Keeps the last max_turns question/answer pairs word for word, as long as they fit in
+    max_token_limit tokens (counted with tiktoken). Older turns get folded into a running
+    summary, so the history in the prompt stops growing however long the session goes.
+    """
+
+    max_turns: int = MEMORY_MAX_TURNS
+    token_model: str = "gpt-4o"
+
+    def count_tokens(self, messages):
+        encoding = get_encoding(self.token_model)
+        # ~4 tokens of chat formatting per message
+        return sum(len(encoding.encode(str(message.content))) + 4 for message in messages)
+
+    def prune(self):
+        buffer = self.chat_memory.messages
+        pruned = []
+        # drop whole turns (question + answer) from the front
+        while buffer and (len(buffer) > self.max_turns * 2 or self.count_tokens(buffer) > self.max_token_limit):
+            pruned.extend(buffer[:2])
+            del buffer[:2]
+        if pruned:
+            self.moving_summary_buffer = self.predict_new_summary(pruned, self.moving_summary_buffer)
+
+def create_memory(memory_key, output_key, memory_mode="rolling"):
+    """memory_mode="buffer" keeps the whole history, "rolling" keeps recent turns + a summary"""
+    if memory_mode == "buffer":
+        return ConversationBufferMemory(memory_key=memory_key, return_messages=True, output_key=output_key)
+    return RollingSummaryMemory(
+        llm=ChatOpenAI(model = "gpt-4o"),
+        prompt=SUMMARY_PROMPT,
+        max_token_limit=MEMORY_TOKEN_LIMIT,
+        memory_key=memory_key,
+        return_messages=True,
+        output_key=output_key,
+    )
+
+# words that usually point back at earlier turns ("explain it again", "what about those?")
+FOLLOW_UP_WORDS = {
+    "it", "its", "this", "that", "these", "those", "they", "them", "their", "he", "she", "him", "her",
+    "above", "previous", "earlier", "again", "more", "else", "also", "same", "one", "ones", "other",
+}
+
+def question_words(question):
+    return re.findall(r"[a-z0-9']+", question.lower())
+
+def is_self_contained(question):
+    """Rough guess whether a question makes sense without the chat history"""
+    words = question_words(question)
+    return len(words) >= 4 and not FOLLOW_UP_WORDS.intersection(words)
+
+class FastConversationalRetrievalChain(ConversationalRetrievalChain):
+    """
+    ConversationalRetrievalChain that doesn't always wait for the question rephrasing llm call.
+    With condense_mode="fast" first turns and questions that look self-contained skip the
+    rephrasing call, follow-ups get rephrased and searched with the rephrased question.
+    condense_mode="always" behaves like the stock chain.
+    """
+
+    condense_mode: str = "fast"
+
+    def _call(self, inputs, run_manager=None):
+        if self.condense_mode == "always":
+            return super()._call(inputs, run_manager)
+
+        _run_manager = run_manager or CallbackManagerForChainRun.get_noop_manager()
+        question = inputs["question"]
+        get_chat_history = self.get_chat_history or _get_chat_history
+        chat_history_str = get_chat_history(inputs["chat_history"])
+
+        if not chat_history_str or is_self_contained(question):
+            new_question = question
+            docs = self._get_docs(question, inputs, run_manager=_run_manager)
+        else:
+            # follow-ups lean on the history, only the rephrased question finds the right context
+            new_question = self.question_generator.run(
+                question=question,
+                chat_history=chat_history_str,
+                callbacks=_run_manager.get_child(),
+            )
+            docs = self._get_docs(new_question, inputs, run_manager=_run_manager)
+
+        output = {}
+        if self.response_if_no_docs_found is not None and len(docs) == 0:
+            output[self.output_key] = self.response_if_no_docs_found
+        else:
+            new_inputs = inputs.copy()
+            if self.rephrase_question:
+                new_inputs["question"] = new_question
+            new_inputs["chat_history"] = chat_history_str
+            output[self.output_key] = self.combine_docs_chain.run(
+                input_documents=docs,
+                callbacks=_run_manager.get_child(),
+                **new_inputs,
+            )
+        if self.return_source_documents:
+            output["source_documents"] = docs
+        if self.return_generated_question:
+            output["generated_question"] = new_question
+        return output
+
+def create_qa_chain(retriever, condense_mode="fast", memory_mode="rolling"):
     """
     Sets up a chatbot that can answer questions about our docs.
+    condense_mode="always" rephrases every follow-up question before searching (slower, the old way).
+    memory_mode="buffer" keeps the whole chat history in the prompt (see create_memory).
     """
    
     custom_prompt = PromptTemplate(
@@ -44,27 +202,27 @@ def create_qa_chain(retriever):
     """
     )
 
-    # Updated memory implementation
-    memory = ConversationBufferMemory(
-        memory_key="chat_history",
-        return_messages=True,
-        output_key="answer"  # Specify the output key
-    )
+    # recent turns verbatim, older ones summarized
+    memory = create_memory("chat_history", "answer", memory_mode)
 
-    llm = ChatOpenAI(model = "gpt-4o")
+    # only the answer streams, the question rephrasing call runs as usual
+    llm = ChatOpenAI(model = "gpt-4o", streaming=True, tags=[ANSWER_TAG])
+    condense_llm = ChatOpenAI(model = "gpt-4o")
 
-    qa_chain = ConversationalRetrievalChain.from_llm(
+    qa_chain = FastConversationalRetrievalChain.from_llm(
         llm=llm,
+        condense_question_llm=condense_llm,
         retriever=retriever,
         memory=memory,
         combine_docs_chain_kwargs={"prompt": custom_prompt},
         return_source_documents=False,  # Add this to be explicit
+        condense_mode=condense_mode,
         verbose=True
     )
 
     return qa_chain, memory 
 
-def create_topic_qa_chain(topic):
+def create_topic_qa_chain(topic, memory_mode="rolling"):
     """
     Sets up a chatbot that can teach about a specific topic without needing documents.
     """
@@ -98,14 +256,10 @@ def create_topic_qa_chain(topic):
     """
     )
 
-    # Updated memory implementation
-    memory = ConversationBufferMemory(
-        memory_key="history",
-        return_messages=True,
-        output_key="response"  # Specify the output key
-    )
+    # recent turns verbatim, older ones summarized
+    memory = create_memory("history", "response", memory_mode)
 
-    llm = ChatOpenAI(model = "gpt-4o")
+    llm = ChatOpenAI(model = "gpt-4o", streaming=True, tags=[ANSWER_TAG])
 
     qa_chain = ConversationChain(
         llm=llm,
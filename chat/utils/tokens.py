@@ -0,0 +1,12 @@
+from functools import lru_cache
+
+import tiktoken
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    # tiktoken tokenizer of an openai model, models it doesn't know yet get the newest encoding
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
@@ -0,0 +1,94 @@
+import hashlib
+import os
+import secrets
+import shutil
+import time
+from pathlib import Path
+
+from langchain_community.vectorstores import FAISS
+
+# indexes of uploaded pdfs, shared by every session that uploads the same file
+UPLOAD_CACHE_DIR = os.getenv("UPLOAD_CACHE_DIR", str(Path(__file__).parent.parent.parent / ".cache" / "uploads"))
+UPLOAD_CACHE_MAX_MB = int(os.getenv("UPLOAD_CACHE_MAX_MB", "1024"))
+
+READY_NAME = "READY"
+
+
+def content_key(data, embedding_key=""):
+    # the same pdf embedded with another model is a different index
+    digest = hashlib.sha256(embedding_key.encode("utf-8"))
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def dir_size(path):
+    return sum(p.stat().st_size for p in Path(path).rglob("*") if p.is_file())
+
+
+class UploadIndexCache:
+    """
+    On-disk FAISS indexes of uploaded pdfs, one directory per content hash.
+    A directory only counts once its READY marker exists, and the marker's mtime
+    is when it was last used, so the least recently used ones get evicted first
+    once the whole cache passes max_bytes.
+    """
+
+    def __init__(self, root, max_bytes=1024 ** 3):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def path_for(self, key):
+        return self.root / key
+
+    def load(self, key, embeddings):
+        """Returns the cached db for this content hash, or None"""
+        path = self.path_for(key)
+        marker = path / READY_NAME
+        if not marker.exists():
+            return None
+        try:
+            db = FAISS.load_local(str(path), embeddings, allow_dangerous_deserialization=True)
+        except (OSError, RuntimeError):
+            # evicted by another process while we were reading it
+            return None
+        marker.touch()
+        return db
+
+    def save(self, key, db):
+        path = self.path_for(key)
+        if (path / READY_NAME).exists():
+            return path
+        # write next to it and rename, so nobody ever loads half an index
+        staging = self.root / f".tmp-{key}-{secrets.token_hex(3)}"
+        db.save_local(str(staging))
+        (staging / READY_NAME).touch()
+        try:
+            staging.rename(path)
+        except OSError:
+            # another session finished the same upload first
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict(keep=key)
+        return path
+
+    def evict(self, keep=None):
+        entries = []
+        for path in self.root.iterdir():
+            marker = path / READY_NAME
+            if path.is_dir() and marker.exists():
+                entries.append((marker.stat().st_mtime, path, dir_size(path)))
+            elif path.is_dir() and path.name.startswith(".tmp-") and time.time() - path.stat().st_mtime > 3600:
+                # leftovers of sessions that died while saving
+                shutil.rmtree(path, ignore_errors=True)
+        total = sum(size for _, _, size in entries)
+        for _, path, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path.name == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+def create_upload_cache():
+    return UploadIndexCache(UPLOAD_CACHE_DIR, max_bytes=UPLOAD_CACHE_MAX_MB * 1024 ** 2)
@@ -0,0 +1,3 @@
+"""
+Helpers shared by the quiz, flashcards and study planner apps.
+"""
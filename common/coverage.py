@@ -0,0 +1,64 @@
+import math
+import os
+import re
+from collections import Counter
+
+from .fan_out import ITEMS_PER_CHUNK, split_count
+from .token_chunks import CHUNK_TOKENS, iter_token_chunks
+
+# long documents get cut into sections this size, and a spread-out subset of them is sent
+SECTION_TOKENS = int(os.getenv("SECTION_TOKENS", "800"))
+
+WORD_PATTERN = re.compile(r"[a-z][a-z0-9\-]{2,}")
+
+
+def section_scores(sections):
+    """
+    How much a section is worth quizzing on: the summed idf of its distinct words.
+    Words on every slide (course name, headers, footers) count for nothing, so title
+    pages and reference lists score low and dense content scores high.
+    """
+    words = [set(WORD_PATTERN.findall(section.lower())) for section in sections]
+    df = Counter(word for section_words in words for word in section_words)
+    n = len(sections)
+    return [sum(math.log(n / df[word]) for word in section_words) for section_words in words]
+
+
+def pick_sections(scores, k, rotation=0):
+    """
+    Indices of k sections spread over the whole document: the sections are cut into
+    k consecutive stretches and the best scoring one of each stretch is taken.
+    rotation=1 takes the second best of each stretch instead and so on (wrapping around),
+    so repeated generations for the same document don't all read the same text.
+    """
+    n = len(scores)
+    picked = []
+    for i in range(k):
+        ranked = sorted(range(i * n // k, (i + 1) * n // k), key=lambda j: -scores[j])
+        picked.append(ranked[rotation % len(ranked)])
+    return picked
+
+
+def coverage_chunks(content, encoding, count, token_budget=CHUNK_TOKENS, section_tokens=SECTION_TOKENS,
+                    items_per_chunk=ITEMS_PER_CHUNK, rotation=0):
+    """
+    The texts to generate `count` questions/cards from, one per request.
+    Content within token_budget is sent whole in one piece like before. Anything longer
+    gets cut into sections of section_tokens, and a spread-out subset of them (at most
+    token_budget tokens in total) is grouped, in document order, into one text per request.
+    rotation picks a different subset each time (see pick_sections).
+    """
+    sections = list(iter_token_chunks(content, encoding, section_tokens))
+    k = max(1, token_budget // section_tokens)
+    if len(sections) <= k:
+        text = content.strip()
+        return [text] if text else []
+
+    picked = pick_sections(section_scores(sections), k, rotation)
+    requests = min(len(picked), max(1, math.ceil(count / items_per_chunk)))
+    chunks = []
+    start = 0
+    for size in split_count(len(picked), requests):
+        chunks.append("\n\n".join(sections[i] for i in picked[start:start + size]))
+        start += size
+    return chunks
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+from PyPDF2 import PdfReader
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+# page counts and hashes of documents/, so the apps don't open pdfs just to render a sidebar
+CATALOG_PATH = os.getenv(
+    "DOCUMENT_CATALOG_PATH", str(Path(__file__).resolve().parent.parent / ".cache" / "catalog.json")
+)
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class _CatalogChangeHandler(FileSystemEventHandler):
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def on_any_event(self, event):
+        if event.event_type in ("created", "modified", "moved", "deleted"):
+            self.catalog.dirty = True
+
+
+class DocumentCatalog:
+    """
+    Every subject folder and pdf under documents_path with its page count, size,
+    sha256 and modification time.
+    Built once (unchanged pdfs come from the json saved at cache_path, so a restart
+    doesn't re-read them) and rescanned only after watchdog saw something change.
+    """
+
+    def __init__(self, documents_path, cache_path=None, watch=True):
+        self.documents_path = Path(documents_path)
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.lock = threading.Lock()
+        self.subjects_list = []
+        self.entries = {}
+        self.dirty = True
+        self.observer = None
+        if watch:
+            self.start_watching()
+
+    def start_watching(self):
+        if self.observer is not None or not self.documents_path.exists():
+            return
+        self.observer = Observer()
+        self.observer.daemon = True
+        self.observer.schedule(_CatalogChangeHandler(self), str(self.documents_path), recursive=True)
+        self.observer.start()
+
+    def stop_watching(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer = None
+
+    def _load_saved(self):
+        if self.cache_path is None or not self.cache_path.exists():
+            return {}
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if saved.get("documents_path") != str(self.documents_path.resolve()):
+            return {}
+        return saved.get("entries", {})
+
+    def _save(self):
+        if self.cache_path is None:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cache_path.with_name(f"{self.cache_path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"documents_path": str(self.documents_path.resolve()), "entries": self.entries}, f, indent=2)
+        os.replace(tmp_path, self.cache_path)
+
+    def refresh(self):
+        """Rescans documents_path, only pdfs whose size or mtime changed get opened"""
+        with self.lock:
+            # clear first, events during the scan mark it dirty again
+            self.dirty = False
+            known = self.entries or self._load_saved()
+            subjects = []
+            entries = {}
+            if self.documents_path.exists():
+                for folder in self.documents_path.iterdir():
+                    if not folder.is_dir() or folder.name.startswith("."):
+                        continue
+                    subjects.append(folder.name)
+                    for file in folder.iterdir():
+                        if not file.is_file() or file.suffix.lower() != ".pdf":
+                            continue
+                        rel_path = f"{folder.name}/{file.name}"
+                        stat = file.stat()
+                        entry = known.get(rel_path)
+                        if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+                            entry = self._describe(file, folder.name, stat)
+                        entries[rel_path] = entry
+            changed = entries != self.entries
+            self.subjects_list = subjects
+            self.entries = entries
+            if changed:
+                self._save()
+
+    def _describe(self, file, subject, stat):
+        try:
+            pages = len(PdfReader(str(file)).pages)
+            error = None
+        except Exception as e:
+            pages = None
+            error = str(e)
+        return {
+            "subject": subject,
+            "name": file.name,
+            "pages": pages,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": hash_file(file),
+            "error": error,
+        }
+
+    def _fresh(self):
+        if self.dirty:
+            self.refresh()
+
+    def subjects(self):
+        self._fresh()
+        # the queries take the lock too, so they wait for a rescan another thread is in the middle of
+        with self.lock:
+            return list(self.subjects_list)
+
+    def pdfs(self, subject):
+        """File names of the pdfs of a subject"""
+        self._fresh()
+        with self.lock:
+            return [entry["name"] for entry in self.entries.values() if entry["subject"] == subject]
+
+    def entry(self, subject, name):
+        """Catalog entry of one pdf, or None if there's no such file"""
+        self._fresh()
+        with self.lock:
+            return self.entries.get(f"{subject}/{name}")
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_document_catalog(documents_path="documents"):
+    """One catalog per documents folder per process, so streamlit reruns reuse it"""
+    key = str(Path(documents_path).resolve())
+    with _catalogs_lock:
+        if key not in _catalogs:
+            _catalogs[key] = DocumentCatalog(documents_path, CATALOG_PATH)
+        return _catalogs[key]
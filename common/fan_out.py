@@ -0,0 +1,44 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+# a document spanning several chunks gets about this many questions/cards asked per chunk
+ITEMS_PER_CHUNK = int(os.getenv("ITEMS_PER_CHUNK", "5"))
+# at most this many generation requests are in flight at once
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "4"))
+
+
+def split_count(count, parts):
+    """Splits count over parts as evenly as possible, the first parts get the remainder"""
+    base, extra = divmod(count, parts)
+    return [base + (1 if i < extra else 0) for i in range(parts)]
+
+
+def generate_across_chunks(chunks, count, generate, items_key, items_per_chunk=ITEMS_PER_CHUNK,
+                           max_workers=MAX_CONCURRENT_REQUESTS):
+    """
+    Asks for `count` items spread over the first ceil(count / items_per_chunk) chunks,
+    all requests at once on a thread pool, and returns the items in chunk order.
+    generate(chunk_text, n) returns the parsed json, items are under items_key.
+    Only the chunks that are used get pulled from `chunks`. If the model came back short,
+    the following chunks fill the gap one at a time.
+    """
+    if count <= 0:
+        return []
+    chunks = iter(chunks)
+    batch = list(islice(chunks, max(1, math.ceil(count / items_per_chunk))))
+    if not batch:
+        return []
+
+    counts = split_count(count, len(batch))
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batch)))) as pool:
+        results = list(pool.map(lambda job: generate(*job)[items_key], zip(batch, counts)))
+    items = [item for result in results for item in result]
+
+    for chunk in chunks:
+        remaining = count - len(items)
+        if remaining <= 0:
+            break
+        items.extend(generate(chunk, remaining)[items_key])
+    return items
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from PyPDF2 import PdfReader
+
+# per-page text of every lecture pdf any of the apps ever read
+PDF_TEXT_CACHE_DIR = os.getenv(
+    "PDF_TEXT_CACHE_DIR", str(Path(__file__).resolve().parent.parent / ".cache" / "pdf_text")
+)
+
+
+def file_key(pdf_path):
+    """Changes whenever the file does: path, size and modification time"""
+    pdf_path = Path(pdf_path).resolve()
+    stat = pdf_path.stat()
+    return hashlib.sha256(f"{pdf_path}|{stat.st_size}|{stat.st_mtime_ns}".encode("utf-8")).hexdigest()
+
+
+class PdfTextStore:
+    """
+    Extracts the text of a pdf once, page by page, and keeps it on disk so the quiz,
+    flashcards and study planner apps (separate processes) all reuse the same extraction.
+    The last few pdfs also stay in memory.
+    """
+
+    def __init__(self, root, memory_items=32):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.memory_items = memory_items
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _remember(self, key, pages):
+        with self.lock:
+            self.memory[key] = pages
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_items:
+                self.memory.popitem(last=False)
+
+    def _cached(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+
+        cache_file = self.root / f"{key}.json"
+        if cache_file.exists():
+            try:
+                with open(cache_file, "r", encoding="utf-8") as f:
+                    pages = json.load(f)["pages"]
+                self._remember(key, pages)
+                return pages
+            except (OSError, ValueError, KeyError):
+                pass  # half written or damaged, extract it again
+        return None
+
+    def _save(self, key, pdf_path, pages):
+        cache_file = self.root / f"{key}.json"
+        # write next to it and rename, the other apps might be reading the same file
+        tmp_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({"source": str(pdf_path), "pages": pages}, f, ensure_ascii=False)
+        os.replace(tmp_file, cache_file)
+        self._remember(key, pages)
+
+    def pages(self, pdf_path):
+        """List with the text of every page"""
+        key = file_key(pdf_path)
+        pages = self._cached(key)
+        if pages is None:
+            reader = PdfReader(str(pdf_path))
+            pages = [page.extract_text() or "" for page in reader.pages]
+            self._save(key, pdf_path, pages)
+        return pages
+
+    def text(self, pdf_path, separator=""):
+        return separator.join(self.pages(pdf_path))
+
+
+_store = None
+
+
+def get_pdf_text_store():
+    """One store per process"""
+    global _store
+    if _store is None:
+        _store = PdfTextStore(PDF_TEXT_CACHE_DIR)
+    return _store
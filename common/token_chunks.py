@@ -0,0 +1,14 @@
+# the quiz and flashcard generators send at most this many tokens per request
+CHUNK_TOKENS = 10000
+
+
+def iter_token_chunks(text, encoding, chunk_size=CHUNK_TOKENS):
+    """Cuts text into chunks of at most chunk_size tokens"""
+    tokens = encoding.encode(text)
+    if len(tokens) <= chunk_size:
+        # it all fits into one chunk, hand it over as it is
+        if text.strip():
+            yield text.strip()
+        return
+    for i in range(0, len(tokens), chunk_size):
+        yield encoding.decode(tokens[i:i + chunk_size])
@@ -0,0 +1,149 @@
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+# generated decks and every rating, so a refresh or restart doesn't cost another generation
+DECK_STORE_PATH = os.getenv(
+    "DECK_STORE_PATH", str(Path(__file__).resolve().parent.parent / ".cache" / "flashcards.sqlite")
+)
+
+# when a card comes up for review again after each rating
+REVIEW_INTERVALS = {
+    "didnt_know": 0,
+    "somewhat_knew": 24 * 3600,
+    "knew_well": 3 * 24 * 3600,
+}
+
+
+class DeckStore:
+    """
+    Flashcard decks per (student, subject, pdf), their cards with the latest knowledge
+    level and due date, and the full rating history.
+    A deck only counts for a pdf as long as the pdf's content hash is the same.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS decks (
+                    id INTEGER PRIMARY KEY,
+                    student TEXT NOT NULL,
+                    subject TEXT NOT NULL,
+                    pdf TEXT NOT NULL,
+                    pdf_hash TEXT NOT NULL,
+                    difficulty TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    prompt_version INTEGER NOT NULL,
+                    created REAL NOT NULL
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS cards (
+                    id INTEGER PRIMARY KEY,
+                    deck_id INTEGER NOT NULL REFERENCES decks (id),
+                    position INTEGER NOT NULL,
+                    front TEXT NOT NULL,
+                    back TEXT NOT NULL,
+                    topic TEXT NOT NULL,
+                    knowledge TEXT NOT NULL DEFAULT 'new',
+                    due REAL NOT NULL
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS ratings (
+                    id INTEGER PRIMARY KEY,
+                    card_id INTEGER NOT NULL REFERENCES cards (id),
+                    knowledge TEXT NOT NULL,
+                    rated_at REAL NOT NULL
+                )"""
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS decks_lookup ON decks (student, subject, pdf, difficulty, created)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cards_deck ON cards (deck_id, position)")
+            conn.execute("CREATE INDEX IF NOT EXISTS cards_due ON cards (deck_id, due)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ratings_card ON ratings (card_id, rated_at)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def save_deck(self, student, subject, pdf, pdf_hash, difficulty, cards, model, prompt_version):
+        """Stores a freshly generated deck, returns (deck id, card ids in order)"""
+        now = time.time()
+        with self._connect() as conn:
+            deck_id = conn.execute(
+                "INSERT INTO decks (student, subject, pdf, pdf_hash, difficulty, model, prompt_version, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (student, subject, pdf, pdf_hash, difficulty, model, prompt_version, now),
+            ).lastrowid
+            card_ids = []
+            for position, card in enumerate(cards):
+                card_ids.append(conn.execute(
+                    "INSERT INTO cards (deck_id, position, front, back, topic, due) VALUES (?, ?, ?, ?, ?, ?)",
+                    (deck_id, position, card["front"], card["back"], card.get("topic", ""), now),
+                ).lastrowid)
+        return deck_id, card_ids
+
+    def load_deck(self, student, subject, pdf, pdf_hash, difficulty):
+        """
+        The student's latest deck for this pdf and difficulty in one indexed read, or None.
+        Returns {"deck_id", "card_ids", "cards", "knowledge"} with knowledge by card position
+        (cards never rated are left out, like in the app's session state).
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                """SELECT cards.deck_id, cards.id, cards.front, cards.back, cards.topic, cards.knowledge
+                FROM cards JOIN (
+                    SELECT id, pdf_hash FROM decks
+                    WHERE student = ? AND subject = ? AND pdf = ? AND difficulty = ?
+                    ORDER BY created DESC LIMIT 1
+                ) AS deck ON cards.deck_id = deck.id
+                WHERE deck.pdf_hash = ?
+                ORDER BY cards.position""",
+                (student, subject, pdf, difficulty, pdf_hash),
+            ).fetchall()
+        if not rows:
+            return None
+        return {
+            "deck_id": rows[0][0],
+            "card_ids": [row[1] for row in rows],
+            "cards": [{"front": front, "back": back, "topic": topic} for _, _, front, back, topic, _ in rows],
+            "knowledge": {i: row[5] for i, row in enumerate(rows) if row[5] != "new"},
+        }
+
+    def rate(self, card_id, knowledge):
+        """Records a rating and moves the card's due date"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE cards SET knowledge = ?, due = ? WHERE id = ?",
+                (knowledge, now + REVIEW_INTERVALS.get(knowledge, 0), card_id),
+            )
+            conn.execute(
+                "INSERT INTO ratings (card_id, knowledge, rated_at) VALUES (?, ?, ?)", (card_id, knowledge, now)
+            )
+
+    def due_cards(self, deck_id, now=None):
+        """Positions of the deck's cards that are due for review, unknown ones first, then the most overdue"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT position FROM cards WHERE deck_id = ? AND due <= ? "
+                "ORDER BY CASE knowledge WHEN 'didnt_know' THEN 0 WHEN 'somewhat_knew' THEN 1 ELSE 2 END, due",
+                (deck_id, now if now is not None else time.time()),
+            ).fetchall()
+        return [position for position, in rows]
+
+
+_store = None
+
+
+def get_deck_store():
+    """One store per process"""
+    global _store
+    if _store is None:
+        _store = DeckStore(DECK_STORE_PATH)
+    return _store
@@ -1,37 +1,21 @@
+import os
+import sys
 from pathlib import Path
-from PyPDF2 import PdfReader
+
+# shared helpers live in common/ at the project root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.document_catalog import get_document_catalog
+from common.pdf_text_store import get_pdf_text_store
 
 def get_subjects():
-    """Get list of subjects from the documents folder"""
-    docs_path = Path("documents")
-    
-    # Skip if documents folder doesn't exist
-    if not docs_path.exists():
-        return []
-    
-    # Get subject folders (skip hidden folders)
-    subjects = []
-    for folder in docs_path.iterdir():
-        if folder.is_dir() and not folder.name.startswith('.'):
-            subjects.append(folder.name)
-            
-    return subjects
+    """Get list of subjects from the documents folder (skips hidden folders)"""
+    # the catalog only rescans the folder after something in it changed
+    return get_document_catalog("documents").subjects()
 
 def get_pdfs_for_subject(subject):
     """Get PDF files available for a subject"""
-    subject_path = Path("documents") / subject
-    
-    # Skip if subject folder doesn't exist
-    if not subject_path.exists():
-        return []
-    
-    # Get PDF files
-    pdfs = []
-    for file in subject_path.iterdir():
-        if file.is_file() and file.suffix.lower() == '.pdf':
-            pdfs.append(file.name)
-            
-    return pdfs
+    return get_document_catalog("documents").pdfs(subject)
 
 def read_pdf(subject, filename):
     """Read and get text from a PDF file"""
@@ -41,29 +25,21 @@ def read_pdf(subject, filename):
     if not pdf_path.exists():
         raise FileNotFoundError(f"Can't find PDF file: {filename}")
     
-    # Read PDF content
+    # Read PDF content, the text store only parses it the first time any app asks
     try:
-        reader = PdfReader(pdf_path)
-        text = ""
-        
-        # Get text from each page
-        for page in reader.pages:
-            text += page.extract_text()
-            
+        text = get_pdf_text_store().text(pdf_path)
         return text.strip()
         
     except Exception as e:
         raise Exception(f"Had trouble reading the PDF: {str(e)}")
 
 def get_pdf_pages(subject, filename):
-    """Get total pages in the PDF"""
-    pdf_path = Path("documents") / subject / filename
+    """Get total pages in the PDF, counted once by the document catalog"""
+    entry = get_document_catalog("documents").entry(subject, filename)
     
-    if not pdf_path.exists():
+    if entry is None:
         raise FileNotFoundError(f"Can't find PDF file: {filename}")
     
-    try:
-        reader = PdfReader(pdf_path)
-        return len(reader.pages)
-    except Exception as e:
-        raise Exception(f"Had trouble reading the PDF: {str(e)}")
+    if entry["pages"] is None:
+        raise Exception(f"Had trouble reading the PDF: {entry['error']}")
+    return entry["pages"]
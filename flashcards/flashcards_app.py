@@ -1,6 +1,15 @@
+import os
+import sys
+import uuid
 import streamlit as st
+
+# shared helpers live in common/ at the project root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 from document_utils import get_subjects, get_pdfs_for_subject, read_pdf, get_pdf_pages
 from flashcards_generator import FlashcardMaker
+from deck_store import get_deck_store
+from common.document_catalog import get_document_catalog
 import json
 from datetime import datetime, timedelta
 
@@ -10,6 +19,7 @@ st.title("Study Buddy Flashcard Generator 🎴")
 
 # Initialize flashcard maker
 flashcard_maker = FlashcardMaker()
+deck_store = get_deck_store()
 
 # Initialize session state
 if "current_card" not in st.session_state:
@@ -20,11 +30,42 @@ if "show_back" not in st.session_state:
     st.session_state.show_back = False
 if "card_knowledge" not in st.session_state:
     st.session_state.card_knowledge = {}  # Stores knowledge level for each card
+if "deck_id" not in st.session_state:
+    st.session_state.deck_id = None
+if "card_ids" not in st.session_state:
+    st.session_state.card_ids = []  # Deck store ids, same order as the cards
+if "deck_selection" not in st.session_state:
+    st.session_state.deck_selection = None
+# Students without a name get an id kept in the URL, so a refresh finds their decks again
+if "student" not in st.query_params:
+    st.query_params["student"] = f"guest-{uuid.uuid4().hex}"
+
+def rate_card(card_idx, knowledge):
+    # Keep the rating for this session and in the deck store
+    st.session_state.card_knowledge[card_idx] = knowledge
+    if st.session_state.card_ids:
+        deck_store.rate(st.session_state.card_ids[card_idx], knowledge)
+
+def rate_and_advance(card_idx, current_idx, total, knowledge):
+    rate_card(card_idx, knowledge)
+    if review_mode and card_idx not in deck_store.due_cards(st.session_state.deck_id):
+        # The rated card left the due list, the next one moved up into its place
+        st.session_state.current_card = current_idx
+    else:
+        st.session_state.current_card = (current_idx + 1) % total
+    st.session_state.show_back = False
+    st.rerun()
 
 # Sidebar for document selection and flashcard settings
 with st.sidebar:
     st.header("Flashcard Settings")
     
+    # Decks and ratings are saved per name
+    student = st.text_input(
+        "Your name:",
+        help="Without a name your decks are saved under this page's link, bookmark it to come back to them."
+    ).strip() or st.query_params["student"]
+    
     # Get available subjects
     subjects = get_subjects()
     if not subjects:
@@ -47,6 +88,7 @@ with st.sidebar:
     if pdf_file:
         try:
             pages = get_pdf_pages(subject, pdf_file)
+            pdf_hash = get_document_catalog("documents").entry(subject, pdf_file)["sha256"]
             st.info(f"📄 {pages} pages")
         except Exception as e:
             st.error(f"Error loading PDF: {str(e)}")
@@ -59,6 +101,18 @@ with st.sidebar:
         value="medium"
     )
     
+    # Reopen the saved deck for this PDF and difficulty instead of generating it again
+    selection = (student, subject, pdf_file, difficulty, pdf_hash)
+    if st.session_state.deck_selection != selection:
+        st.session_state.deck_selection = selection
+        deck = deck_store.load_deck(student, subject, pdf_file, pdf_hash, difficulty)
+        st.session_state.cards_data = {"cards": deck["cards"]} if deck else None
+        st.session_state.deck_id = deck["deck_id"] if deck else None
+        st.session_state.card_ids = deck["card_ids"] if deck else []
+        st.session_state.card_knowledge = deck["knowledge"] if deck else {}
+        st.session_state.current_card = 0
+        st.session_state.show_back = False
+    
     num_cards = st.slider(
         "Number of Cards:",
         min_value=5,
@@ -90,8 +144,22 @@ with st.sidebar:
                         difficulty=difficulty
                     )
                     
+                    # Save the deck so it survives refreshes and restarts
+                    deck_id, card_ids = deck_store.save_deck(
+                        student,
+                        subject,
+                        pdf_file,
+                        pdf_hash,
+                        difficulty,
+                        cards_data["cards"],
+                        FlashcardMaker.MODEL,
+                        FlashcardMaker.PROMPT_VERSION
+                    )
+                    
                     # Reset flashcard state
                     st.session_state.cards_data = cards_data
+                    st.session_state.deck_id = deck_id
+                    st.session_state.card_ids = card_ids
                     st.session_state.current_card = 0
                     st.session_state.show_back = False
                     st.session_state.card_knowledge = {}
@@ -106,25 +174,16 @@ if st.session_state.cards_data:
     
     # Handle review mode
     if review_mode:
-        # Get cards that need review (not known well)
-        review_cards = []
-        for i, card in enumerate(cards):
-            knowledge = st.session_state.card_knowledge.get(i, "new")
-            if knowledge != "knew_well":
-                # Sort by knowledge level - unknown first, then somewhat known
-                priority = 0 if knowledge == "didnt_know" else 1 if knowledge == "somewhat_knew" else 2
-                review_cards.append((priority, i, card))
+        # Cards due for review by their ratings (unknown first, then somewhat known)
+        review_cards = [(i, cards[i]) for i in deck_store.due_cards(st.session_state.deck_id)]
         
         if not review_cards:
-            st.info("No cards to review! You knew all cards well.")
+            st.info("No cards due for review right now! Come back later.")
             st.stop()
-            
-        # Sort by priority (unknown first, then somewhat known)
-        review_cards.sort()
         
         # Use review cards instead of all cards
         current_idx = st.session_state.current_card % len(review_cards)
-        _, card_idx, card = review_cards[current_idx]
+        card_idx, card = review_cards[current_idx]
         progress = (current_idx + 1) / len(review_cards)
         total = len(review_cards)
     else:
@@ -170,24 +229,15 @@ if st.session_state.cards_data:
             
     with cols[1]:
         if st.button("❌", use_container_width=True, help="Didn't know"):
-            st.session_state.card_knowledge[card_idx] = "didnt_know"
-            st.session_state.current_card = (current_idx + 1) % total
-            st.session_state.show_back = False
-            st.rerun()
+            rate_and_advance(card_idx, current_idx, total, "didnt_know")
             
     with cols[2]:
         if st.button("⭐", use_container_width=True, help="Somewhat knew"):
-            st.session_state.card_knowledge[card_idx] = "somewhat_knew"
-            st.session_state.current_card = (current_idx + 1) % total
-            st.session_state.show_back = False
-            st.rerun()
+            rate_and_advance(card_idx, current_idx, total, "somewhat_knew")
             
     with cols[3]:
         if st.button("✅", use_container_width=True, help="Knew well"):
-            st.session_state.card_knowledge[card_idx] = "knew_well"
-            st.session_state.current_card = (current_idx + 1) % total
-            st.session_state.show_back = False
-            st.rerun()
+            rate_and_advance(card_idx, current_idx, total, "knew_well")
             
     with cols[4]:
         if st.button("➡️", use_container_width=True):
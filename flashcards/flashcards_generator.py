@@ -1,43 +1,39 @@
 from openai import OpenAI
 import json
 import os
+import sys
 from dotenv import load_dotenv
 import tiktoken
 
+# shared helpers live in common/ at the project root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.coverage import coverage_chunks
+from common.fan_out import generate_across_chunks
+
 # Load environment variables
 load_dotenv()
 
 class FlashcardMaker:
+    MODEL = "gpt-4-turbo-preview"
+    # bump when the prompt changes, saved decks remember which one made them
+    PROMPT_VERSION = 1
+    
     def __init__(self):
         self.client = OpenAI()
         self.encoding = tiktoken.get_encoding("cl100k_base")
     
     def make_flashcards(self, content, num_cards=10, difficulty="medium"):
         """Create flashcards from the given content"""
-        tokens = self.encoding.encode(content)
-        total_tokens = len(tokens)
+        chunks = coverage_chunks(content, self.encoding, num_cards)
         
-        # For small content, use it all
-        if total_tokens <= 10000:
-            return self.generate_flashcards(content, num_cards, difficulty)
-            
-        # For larger content, split into 10k chunks
-        cards = []
-        chunk_size = 10000
-        
-        for i in range(0, total_tokens, chunk_size):
-            # Get chunk of 10k tokens
-            chunk_tokens = tokens[i:i + chunk_size]
-            chunk_text = self.encoding.decode(chunk_tokens)
-            
-            # Calculate remaining cards needed
-            remaining = num_cards - len(cards)
-            if remaining <= 0:
-                break
-                
-            # Generate flashcards from this chunk
-            chunk_cards = self.generate_flashcards(chunk_text, remaining, difficulty)
-            cards.extend(chunk_cards["cards"])
+        # Long content: sections sampled from the whole document, split over a few requests sent at once
+        cards = generate_across_chunks(
+            chunks,
+            num_cards,
+            lambda chunk_text, count: self.generate_flashcards(chunk_text, count, difficulty),
+            "cards"
+        )
         
         return {"cards": cards}
     
@@ -81,7 +77,7 @@ class FlashcardMaker:
         
         try:
             response = self.client.chat.completions.create(
-                model="gpt-4-turbo-preview",
+                model=self.MODEL,
                 messages=[
                     {"role": "system", "content": "You are a helpful teacher creating educational flashcards."},
                     {"role": "user", "content": prompt}
@@ -0,0 +1,278 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+# shared helpers live in common/ at the project root
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from document_utils import get_pdfs_for_subject, get_subjects, read_pdf
+from common.document_catalog import get_document_catalog
+from quiz_generator import QuizMaker
+
+# questions generated ahead of time, so starting a quiz doesn't wait on the model
+QUESTION_BANK_PATH = os.getenv(
+    "QUESTION_BANK_PATH", str(Path(__file__).resolve().parent.parent / ".cache" / "question_bank.sqlite")
+)
+# every pdf and difficulty gets filled up to this many questions
+BANK_TARGET = int(os.getenv("QUESTION_BANK_TARGET", "30"))
+# a student with fewer unseen questions than this triggers a background refill
+BANK_LOW_WATER = int(os.getenv("QUESTION_BANK_LOW_WATER", "15"))
+BANK_REFILL = int(os.getenv("QUESTION_BANK_REFILL", "15"))
+# generations a quiz waits for before it goes ahead with fewer questions (duplicates get dropped)
+GENERATE_ATTEMPTS = int(os.getenv("QUESTION_BANK_GENERATE_ATTEMPTS", "3"))
+
+DIFFICULTIES = ["easy", "medium", "hard"]
+
+
+class QuestionBank:
+    """
+    Quiz questions by (pdf content hash, difficulty, prompt version, model), plus which
+    student was served which question so nobody gets the same question twice.
+    Every add is one numbered batch, and a question whose text is already banked under
+    the same key is dropped, so refills never bank the same question again.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS questions (
+                    id INTEGER PRIMARY KEY,
+                    pdf_hash TEXT NOT NULL,
+                    difficulty TEXT NOT NULL,
+                    prompt_version INTEGER NOT NULL,
+                    model TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    question_text TEXT NOT NULL,
+                    batch INTEGER NOT NULL,
+                    created REAL NOT NULL
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS served (
+                    student TEXT NOT NULL,
+                    question_id INTEGER NOT NULL,
+                    served_at REAL NOT NULL,
+                    PRIMARY KEY (student, question_id)
+                )"""
+            )
+            conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS questions_key "
+                "ON questions (pdf_hash, difficulty, prompt_version, model, question_text)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def add(self, key, questions):
+        """Stores the questions under key, returns (ids, questions) of the ones that weren't banked yet"""
+        now = time.time()
+        ids = []
+        added = []
+        with self._connect() as conn:
+            batch = self._next_batch(conn, key)
+            for question in questions:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO questions "
+                    "(pdf_hash, difficulty, prompt_version, model, data, question_text, batch, created) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (*key, json.dumps(question), question_text(question), batch, now),
+                )
+                if cursor.rowcount:
+                    ids.append(cursor.lastrowid)
+                    added.append(question)
+        return ids, added
+
+    def next_batch(self, key):
+        """Number of the next add under key, i.e. how many batches are banked already"""
+        with self._connect() as conn:
+            return self._next_batch(conn, key)
+
+    def _next_batch(self, conn, key):
+        return conn.execute(
+            "SELECT COALESCE(MAX(batch) + 1, 0) FROM questions WHERE pdf_hash = ? AND difficulty = ? "
+            "AND prompt_version = ? AND model = ?",
+            key,
+        ).fetchone()[0]
+
+    def count(self, key):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM questions WHERE pdf_hash = ? AND difficulty = ? AND prompt_version = ? "
+                "AND model = ?",
+                key,
+            ).fetchone()[0]
+
+    def unseen_count(self, key, student):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM questions WHERE pdf_hash = ? AND difficulty = ? AND prompt_version = ? "
+                "AND model = ? AND id NOT IN (SELECT question_id FROM served WHERE student = ?)",
+                (*key, student),
+            ).fetchone()[0]
+
+    def sample(self, key, student, n):
+        """Up to n random questions the student hasn't seen yet, marked as served"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, data FROM questions WHERE pdf_hash = ? AND difficulty = ? AND prompt_version = ? "
+                "AND model = ? AND id NOT IN (SELECT question_id FROM served WHERE student = ?) "
+                "ORDER BY RANDOM() LIMIT ?",
+                (*key, student, n),
+            ).fetchall()
+            self._mark_served(conn, student, [question_id for question_id, _ in rows])
+        return [json.loads(data) for _, data in rows]
+
+    def mark_served(self, student, ids):
+        with self._connect() as conn:
+            self._mark_served(conn, student, ids)
+
+    def _mark_served(self, conn, student, ids):
+        now = time.time()
+        conn.executemany(
+            "INSERT OR IGNORE INTO served (student, question_id, served_at) VALUES (?, ?, ?)",
+            [(student, question_id, now) for question_id in ids],
+        )
+
+
+def question_text(question):
+    # what counts as the same question: its text, ignoring case and spacing
+    return " ".join(str(question.get("question", "")).lower().split())
+
+
+def bank_key(subject, filename, difficulty):
+    """Bank key of a pdf in documents/, the content hash comes from the document catalog"""
+    entry = get_document_catalog("documents").entry(subject, filename)
+    if entry is None:
+        raise FileNotFoundError(f"Can't find PDF file: {filename}")
+    return (entry["sha256"], difficulty, QuizMaker.PROMPT_VERSION, QuizMaker.MODEL)
+
+
+def generate_into_bank(bank, quiz_maker, subject, filename, difficulty, n):
+    """
+    Generates n questions for the pdf, banks them and returns (ids, questions) of the new ones.
+    Every batch samples other sections of a long pdf, so refills don't ask about the same text again.
+    """
+    key = bank_key(subject, filename, difficulty)
+    rotation = bank.next_batch(key)
+    questions = quiz_maker.make_quiz(read_pdf(subject, filename), n, difficulty, rotation)["questions"]
+    return bank.add(key, questions)
+
+
+_generating = set()
+_generating_lock = threading.Condition()
+
+
+def _claim(job, wait=False):
+    # one generation per pdf and difficulty at a time, the filler and refills would double up otherwise
+    with _generating_lock:
+        while wait and job in _generating:
+            _generating_lock.wait()
+        if job in _generating:
+            return False
+        _generating.add(job)
+        return True
+
+
+def _release(job):
+    with _generating_lock:
+        _generating.discard(job)
+        _generating_lock.notify_all()
+
+
+def top_up(bank, quiz_maker, subject, filename, difficulty, target=BANK_TARGET):
+    job = (subject, filename, difficulty)
+    if not _claim(job):
+        return
+    try:
+        missing = target - bank.count(bank_key(subject, filename, difficulty))
+        if missing > 0:
+            generate_into_bank(bank, quiz_maker, subject, filename, difficulty, missing)
+    finally:
+        _release(job)
+
+
+def fill_bank(bank, quiz_maker, target=BANK_TARGET):
+    """Tops up every pdf in documents/ at every difficulty, skipping the ones that fail"""
+    for subject in get_subjects():
+        for filename in get_pdfs_for_subject(subject):
+            for difficulty in DIFFICULTIES:
+                try:
+                    top_up(bank, quiz_maker, subject, filename, difficulty, target)
+                except Exception as e:
+                    print(f"Couldn't fill the question bank for {subject}/{filename} ({difficulty}): {str(e)}")
+
+
+def refill_in_background(bank, quiz_maker, subject, filename, difficulty, n=BANK_REFILL):
+    """Adds n questions on a daemon thread, unless that pdf and difficulty is being generated already"""
+    job = (subject, filename, difficulty)
+    if not _claim(job):
+        return
+
+    def run():
+        try:
+            generate_into_bank(bank, quiz_maker, subject, filename, difficulty, n)
+        except Exception as e:
+            print(f"Couldn't refill the question bank for {subject}/{filename} ({difficulty}): {str(e)}")
+        finally:
+            _release(job)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def get_quiz(bank, quiz_maker, subject, filename, difficulty, student, num_questions):
+    """
+    num_questions questions the student hasn't seen, straight from the bank.
+    Only when the bank can't cover them the rest gets generated right away, and once
+    the student's unseen questions run low a refill starts in the background.
+    Generated duplicates get dropped, so that takes up to GENERATE_ATTEMPTS rounds; the
+    result says how many were requested in case it still came up short.
+    """
+    key = bank_key(subject, filename, difficulty)
+    questions = bank.sample(key, student, num_questions)
+    job = (subject, filename, difficulty)
+    attempts = 0
+    while len(questions) < num_questions and attempts < GENERATE_ATTEMPTS:
+        # a fill or refill of the same pdf may be running, wait for it instead of generating twice
+        _claim(job, wait=True)
+        try:
+            # and take whatever it banked first
+            questions.extend(bank.sample(key, student, num_questions - len(questions)))
+            missing = num_questions - len(questions)
+            if missing > 0:
+                attempts += 1
+                ids, fresh = generate_into_bank(bank, quiz_maker, subject, filename, difficulty, missing)
+                bank.mark_served(student, ids)
+                questions.extend(fresh)
+        finally:
+            _release(job)
+    if not questions:
+        raise Exception("Couldn't come up with any new questions for this PDF")
+    if bank.unseen_count(key, student) < BANK_LOW_WATER:
+        refill_in_background(bank, quiz_maker, subject, filename, difficulty)
+    return {"questions": questions, "requested": num_questions}
+
+
+_bank = None
+
+
+def get_question_bank():
+    """One bank per process"""
+    global _bank
+    if _bank is None:
+        _bank = QuestionBank(QUESTION_BANK_PATH)
+    return _bank
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate quiz questions for every pdf in documents/")
+    parser.add_argument("--target", type=int, default=BANK_TARGET, help="questions per pdf and difficulty")
+    args = parser.parse_args()
+    fill_bank(get_question_bank(), QuizMaker(), args.target)
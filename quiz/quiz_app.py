@@ -1,6 +1,9 @@
+import threading
+import uuid
 import streamlit as st
-from document_utils import get_subjects, get_pdfs_for_subject, read_pdf, get_pdf_pages
+from document_utils import get_subjects, get_pdfs_for_subject, get_pdf_pages
 from quiz_generator import QuizMaker
+from question_bank import fill_bank, get_question_bank, get_quiz
 
 # Page config
 st.set_page_config(page_title="Study Buddy Quiz", page_icon="📚")
@@ -8,6 +11,16 @@ st.title("Study Buddy Quiz Generator 📚")
 
 # Initialize quiz maker
 quiz_maker = QuizMaker()
+question_bank = get_question_bank()
+
+@st.cache_resource
+def start_bank_filler():
+    # once per server: pre-generate questions for every pdf while students use the app
+    thread = threading.Thread(target=fill_bank, args=(question_bank, quiz_maker), daemon=True)
+    thread.start()
+    return thread
+
+start_bank_filler()
 
 # Initialize session state
 if "current_question" not in st.session_state:
@@ -18,11 +31,16 @@ if "results" not in st.session_state:
     st.session_state.results = []
 if "quiz_complete" not in st.session_state:
     st.session_state.quiz_complete = False
+if "session_id" not in st.session_state:
+    st.session_state.session_id = f"session-{uuid.uuid4().hex}"
 
 # Sidebar for document selection and quiz settings
 with st.sidebar:
     st.header("Quiz Settings")
     
+    # Questions you've already had won't come up again
+    student = st.text_input("Your name:").strip() or st.session_state.session_id
+    
     # Get available subjects
     subjects = get_subjects()
     if not subjects:
@@ -69,14 +87,15 @@ with st.sidebar:
     if st.button("Generate Quiz"):
         with st.spinner("Creating your quiz..."):
             try:
-                # Read PDF content
-                content = read_pdf(subject, pdf_file)
-                
-                # Generate quiz
-                quiz_data = quiz_maker.make_quiz(
-                    content=content,
-                    num_questions=num_questions,
-                    difficulty=difficulty
+                # Serve from the question bank, the model only runs if it's out of new questions
+                quiz_data = get_quiz(
+                    question_bank,
+                    quiz_maker,
+                    subject,
+                    pdf_file,
+                    difficulty,
+                    student,
+                    num_questions
                 )
                 
                 # Reset quiz state
@@ -94,6 +113,10 @@ if st.session_state.quiz_data:
     questions = st.session_state.quiz_data["questions"]
     current_q = st.session_state.current_question
     
+    # The bank and the model couldn't come up with enough new questions
+    if len(questions) < st.session_state.quiz_data.get("requested", len(questions)):
+        st.info(f"Only {len(questions)} new questions left for this PDF, so the quiz is shorter.")
+    
     # Show progress
     progress = (current_q + 1) / len(questions)
     st.progress(progress)
@@ -1,43 +1,40 @@
 from openai import OpenAI
 import json
 import os
+import sys
 from dotenv import load_dotenv
 import tiktoken
 
+# shared helpers live in common/ at the project root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.coverage import coverage_chunks
+from common.fan_out import generate_across_chunks
+
 # Load environment variables
 load_dotenv()
 
 class QuizMaker:
+    MODEL = "gpt-4-turbo-preview"
+    # bump when the prompt changes, banked questions of older prompts stop being served
+    PROMPT_VERSION = 1
+    
     def __init__(self):
         self.client = OpenAI()
         self.encoding = tiktoken.get_encoding("cl100k_base")
     
-    def make_quiz(self, content, num_questions=5, difficulty="medium"):
-        """Create a quiz from the given content"""
-        tokens = self.encoding.encode(content)
-        total_tokens = len(tokens)
+    def make_quiz(self, content, num_questions=5, difficulty="medium", rotation=0):
+        """Create a quiz from the given content.
+        Long content is sampled differently for every rotation"""
+        chunks = coverage_chunks(content, self.encoding, num_questions, rotation=rotation)
         
-        # For small content, use it all
-        if total_tokens <= 10000:
-            return self.generate_questions(content, num_questions, difficulty)
-            
-        # For larger content, split into 10k chunks
-        questions = []
-        chunk_size = 10000
-        
-        for i in range(0, total_tokens, chunk_size):
-            # Get chunk of 10k tokens
-            chunk_tokens = tokens[i:i + chunk_size]
-            chunk_text = self.encoding.decode(chunk_tokens)
-            
-            # Calculate remaining questions needed
-            remaining = num_questions - len(questions)
-            if remaining <= 0:
-                break
-                
-            # Generate questions from this chunk
-            chunk_quiz = self.generate_questions(chunk_text, remaining, difficulty)
-            questions.extend(chunk_quiz["questions"])
+        # Long content: sections sampled from the whole document, split over a few requests sent at once
+        questions = generate_across_chunks(
+            chunks,
+            num_questions,
+            lambda chunk_text, count: self.generate_questions(chunk_text, count, difficulty),
+            "questions"
+        )
         
         return {"questions": questions}
     
@@ -76,7 +73,7 @@ class QuizMaker:
         
         try:
             response = self.client.chat.completions.create(
-                model="gpt-4-turbo-preview",
+                model=self.MODEL,
                 messages=[
                     {"role": "system", "content": "You are a helpful teacher creating quiz questions."},
                     {"role": "user", "content": prompt}
@@ -8,6 +8,7 @@ import re
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from studyplanner.study_plan_generator import StudyPlanGenerator
+from common.document_catalog import get_document_catalog
 
 # Configure Streamlit page
 st.set_page_config(
@@ -148,8 +149,7 @@ def main():
             st.error(f"Documents directory '{documents_dir}' not found!")
             return
         
-        subjects = [d for d in os.listdir(documents_dir) 
-                   if os.path.isdir(os.path.join(documents_dir, d)) and not d.startswith('.')]
+        subjects = get_document_catalog(documents_dir).subjects()
         
         if not subjects:
             st.warning("No subject folders found in documents directory!")
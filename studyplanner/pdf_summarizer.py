@@ -1,9 +1,14 @@
 import os
+import sys
 import json
-from PyPDF2 import PdfReader
 import openai
 from dotenv import load_dotenv
 
+# shared helpers live in common/ at the project root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.pdf_text_store import get_pdf_text_store
+
 # Load environment variables
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
@@ -16,11 +21,9 @@ class PDFSummarizer:
     def extract_text_from_pdf(self, pdf_path):
         """Extract text content from a PDF file."""
         try:
-            reader = PdfReader(pdf_path)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-            return text
+            # parsed once and shared with the quiz and flashcards apps
+            pages = get_pdf_text_store().pages(pdf_path)
+            return "".join(page + "\n" for page in pages)
         except Exception as e:
             print(f"Error extracting text from {pdf_path}: {e}")
             return ""
@@ -1,4 +1,5 @@
 import os
+import sys
 import json
 import datetime
 from dateutil import parser
@@ -7,6 +8,11 @@ from dotenv import load_dotenv
 
 from pdf_summarizer import PDFSummarizer
 
+# shared helpers live in common/ at the project root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.document_catalog import get_document_catalog
+
 # Load environment variables
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
@@ -19,19 +25,12 @@ class StudyPlanGenerator:
     def get_pdf_paths(self, subject):
         """Get paths of all PDF files for a given subject."""
         documents_dir = os.path.join("documents", subject)
-        if not os.path.exists(documents_dir):
-            return []
-        
-        return [os.path.join(documents_dir, f) for f in os.listdir(documents_dir) 
-                if f.endswith('.pdf')]
+        return [os.path.join(documents_dir, f) for f in self.get_pdf_list(subject)]
     
     def get_pdf_list(self, subject):
         """Get a list of available PDF filenames for a subject."""
-        documents_dir = os.path.join("documents", subject)
-        if not os.path.exists(documents_dir):
-            return []
-        
-        return [f for f in os.listdir(documents_dir) if f.endswith('.pdf')]
+        # from the shared catalog, no directory listing on every rerun
+        return get_document_catalog("documents").pdfs(subject)
     
     def ensure_summaries(self, subject, pdf_names):
         """Ensure summaries exist for the selected PDFs."""